@@ -6,10 +6,46 @@ Rackspace Cloud Sites Automation Library
     and interactive with the control panel interface in lieu of an API.
 """
 
-import mechanize
 import re
 import json
-import urllib
+import copy
+import threading
+import Queue
+import time
+import os
+import hashlib
+import sys
+import heapq
+import zlib
+from cStringIO import StringIO
+from collections import OrderedDict
+
+
+class _LazyModule(object):
+    """ Module imported on first attribute access
+            Keeps networking (and command line) imports out of the import of this module, for
+            scripts that only use snapshots; see benchmarks/bench_import.py
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attr):
+        __import__(self._name)
+        module = sys.modules[self._name]
+        # From now on attributes are found without coming back here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+mechanize = _LazyModule('mechanize')
+urllib = _LazyModule('urllib')
+urlparse = _LazyModule('urlparse')
+httplib = _LazyModule('httplib')
+socket = _LazyModule('socket')
+sqlite3 = _LazyModule('sqlite3')
+multiprocessing = _LazyModule('multiprocessing')
+argparse = _LazyModule('argparse')
+getpass = _LazyModule('getpass')
 
 
 
@@ -18,23 +54,44 @@ class CloudSitesCommon(object):
     """ Rackspace Cloud Sites Common Object
             This is for common methods used by all classes.
     """
+    __slots__ = ()
     # Constants
     baseURL = 'https://manage.rackspacecloud.com'
+    # HTML of the page most recently opened by this object (see _openPath)
+    _html = None
+    # Shared PageCache (set from the parent object, None disables caching)
+    cache = None
+    # Parsed JS data of the page in _html (see _jsMemo)
+    _jsMemoData = None
+    # Account this object belongs to (used to log in again when the session times out)
+    account = None
+    # Browser of this object (None = the account's shared one, see browser)
+    _browser = None
+
+    @property
+    def browser(self):
+        """ mechanize.Browser used by this object (the account's shared one unless set)
+        """
+        if self._browser is not None:
+            return self._browser
+        return self.account.browser
+
+    @browser.setter
+    def browser(self, browser):
+        self._browser = browser
 
     def _isLoginPage(self, duringLogin = False):
         """ Determines if the current html page looks like a login page
         """
         for form in self.browser.forms():
             if (form.action.startswith(self.baseURL + '/Login.do')):
-                self.authenticated = False
+                if self.account is not None:
+                    self.account.authenticated = False
                 return True
         return False
 
-    def _openPath(self, path, force=False):
-        """
-            Open a page on Rackspace Cloud Sites, verify we didn't get "timed out"
-
-            path - path to open
+    def _buildURL(self, path):
+        """ Construct a full (sanitized) URL out of a path or URL
         """
         # First, attempt to figure out what "path" was, and construct a URL
         if path.startswith('http'):
@@ -44,19 +101,163 @@ class CloudSitesCommon(object):
         else: # assume they forgot the /
             url = self.baseURL + '/' + path
         # Sanitize
-        url = urllib.quote_plus(url,safe="%/:=&?~#+!$,;'@()*[]")
-        # If the current URL is not the same as the one we want to open
-        # ... or if we want to "force" opening (reopening?)
-        if (self.browser.request.get_full_url != url) or force:
-            # Actually Open the URL
-            self.browser.open(url)
-        # Attempt to determine if we have ended up at the Login Page
-        if (self._isLoginPage()):
-            raise CloudSitesError("ERROR: Session Timed Out or failed")
-            # Perhaps we should "handle" this, like maybe logging in again?
-            exit(1)
+        return urllib.quote_plus(url,safe="%/:=&?~#+!$,;'@()*[]")
+
+    def _openPath(self, path, force=False):
+        """
+            Open a page on Rackspace Cloud Sites, verify we didn't get "timed out"
+
+            path - path to open
+            force - always fetch the page, bypassing the cache (needed before using forms)
+        """
+        url = self._buildURL(path)
+        # Serve it from the page cache if we can
+        if not force and self.cache is not None:
+            prefetcher = self.account.prefetcher if self.account is not None else None
+            if prefetcher is not None:
+                # Being read ahead: wait for that instead of fetching it twice
+                prefetcher.wait(url)
+            html = self.cache.get(url)
+            if html is not None:
+                self._html = html
+                self._emit('cacheHit', url=url, pageType=_pageType(url), bytes=len(html))
+                return True
+        scheduler = self.account.scheduler if self.account is not None else None
+        attempt = 0
+        while True:
+            session = self.account._session if self.account is not None else None
+            if scheduler is not None:
+                waited = scheduler.acquire(_requestPriority())
+                self._emit('schedulerWait', seconds=waited)
+            # Actually Open the URL (reuse of pages is up to the page cache)
+            started = time.time()
+            loginPage = None
+            try:
+                self.browser.open(url)
+                opened = time.time()
+                # Attempt to determine if we have ended up at the Login Page
+                loginPage = self._isLoginPage()
+            finally:
+                if scheduler is not None:
+                    # Errors and login bounces count as bad responses
+                    scheduler.release(time.time() - started, loginPage is False)
+            if not loginPage:
+                break
+            # Session Timed Out: login again (if we know how) and retry the request
+            if self.account is None or not self.account._canRelogin() or attempt >= self.account.reloginRetries:
+                raise CloudSitesError("ERROR: Session Timed Out or failed")
+            time.sleep(self.account.reloginBackoff * (2 ** attempt))
+            attempt += 1
+            self.account._relogin(session)
+            self.account._syncBrowser(self.browser)
+        self._html = self.browser.response().read()
+        self._emit('request', url=url, pageType=_pageType(url), bytes=len(self._html),
+                   seconds=time.time() - started, openSeconds=opened - started,
+                   readSeconds=time.time() - opened)
+        if self.cache is not None:
+            self.cache.put(url, self._html)
+        if self.account is not None and self.account.recorder is not None:
+            self.account.recorder.record(self.account, url, self._html)
         return True
 
+    def _submit(self, url=None, loginPageOK=False):
+        """ Submit the browser's selected form, or open url without the page cache (login,
+            session checks), paced by the account's Scheduler and reported to the hooks
+            (request event) like _openPath
+                ARGS:
+                    - url - open this URL instead of submitting the form
+                    - loginPageOK - landing on the login page is a valid answer (login, session
+                      checks); otherwise it means the session timed out
+
+            RETURN: HTML of the response
+        """
+        scheduler = self.account.scheduler if self.account is not None else None
+        if scheduler is not None:
+            waited = scheduler.acquire(_requestPriority())
+            self._emit('schedulerWait', seconds=waited)
+        started = time.time()
+        loginPage = None
+        try:
+            if url is None:
+                # The form's action, for the request event
+                url = self.browser.form.action
+                response = self.browser.submit()
+            else:
+                response = self.browser.open(url)
+            opened = time.time()
+            loginPage = self._isLoginPage()
+        finally:
+            if scheduler is not None:
+                # Errors and unexpected login page bounces count as bad responses
+                scheduler.release(time.time() - started, loginPage is not None and (loginPageOK or not loginPage))
+        html = response.read()
+        self._emit('request', url=url, pageType=_pageType(url), bytes=len(html),
+                   seconds=time.time() - started, openSeconds=opened - started,
+                   readSeconds=time.time() - opened)
+        if loginPage and not loginPageOK:
+            raise CloudSitesError("ERROR: Session Timed Out or failed")
+        return html
+
+    def _emit(self, event, **data):
+        """ Tell the account's hooks (see Account.addHook) about something that happened
+        """
+        if self.account is not None and self.account.hooks:
+            for hook in self.account.hooks:
+                hook(event, data)
+        return
+
+    def _invalidate(self, *paths):
+        """ Drop the given pages (every page of them for listings) from the page cache
+            (after changing something on them)
+        """
+        if self.cache is not None:
+            account = self.account
+            ignoreParams = (account.pageParam, account.pageSizeParam) if account is not None else ()
+            for path in paths:
+                self.cache.invalidate(self._buildURL(path), ignoreParams)
+
+    def _dropPage(self):
+        """ Forget the page last opened and its parsing memo, once what is needed has been
+            parsed out of it (pages are only kept by the bounded PageCache)
+        """
+        self._html = None
+        self._jsMemoData = None
+        return
+
+    def _currentHtml(self):
+        """ HTML of the page last opened with _openPath (or the browser's current page)
+        """
+        if self._html is not None:
+            return self._html
+        return self.browser.response().read()
+
+    def _jsMemo(self):
+        """ Parsing memo for the current page: (html, tableDataN spans, decoded values)
+            The page is scanned once for the (start, end) offsets of every tableDataN
+            block (nothing is copied out of it until a block is decoded, and the scan
+            skips over the blocks); the memo is rebuilt only when a different page has
+            been opened.
+        """
+        html = self._currentHtml()
+        memo = self._jsMemoData
+        if memo is None or memo[0] is not html:
+            started = time.time()
+            parts = {}
+            position = 0
+            while True:
+                match = _jsVarPartPattern.search(html, position)
+                if match is None:
+                    break
+                end = _jsPartEnd(html, match.end())
+                if end < 0:
+                    break
+                parts.setdefault(match.group('name'), (match.end(), end))
+                position = end + 2
+            memo = (html, parts, {})
+            self._jsMemoData = memo
+            self._emit('parse', varName='(scan)', seconds=time.time() - started, bytes=len(html))
+        return memo
+
     def _parseForJsVar(self,varName='listTableArgs'):
         """ Parse the HTML output of the current browser page for a specific
         JavaScript (JSON) variable. This is probably very specific to the way Rackspace
@@ -67,20 +268,17 @@ class CloudSitesCommon(object):
 
         RETURN: json object representing the JSON parsed screen (or False)
         """
-        html = self.browser.response().read()
-        match = re.search(r'var\s+' + varName + r'\s*=\s*(?P<value>.*?);$',html, re.MULTILINE|re.DOTALL)
-        if match:
-            data = match.group(1).replace('\n','').replace(r'\"', '"').replace(r'\\"', r'\"')
-            try:
-                # Try loading the data using the json parser
-                jsonData = json.loads(data)
-            except:
-                jsonData = False
-                raise CloudSitesError('Error parsing JSON Data for var: ' + varName)
-        else: # no match was found
-            jsonData = False
-            raise CloudSitesError('ERROR: The JS var: ' + varName + ' was not found or there was a matching issue.')
-        return jsonData
+        html, parts, decoded = self._jsMemo()
+        key = 'var ' + varName
+        if key not in decoded:
+            match = _jsPattern('var', varName).search(html)
+            if not match: # no match was found
+                raise CloudSitesError('ERROR: The JS var: ' + varName + ' was not found or there was a matching issue.')
+            started = time.time()
+            start, end = match.span(1)
+            decoded[key] = _decodeJsSpan(html, start, end, varName)
+            self._emit('parse', varName=varName, seconds=time.time() - started, bytes=end - start)
+        return decoded[key]
 
     def _parseForJsVarPart(self,varName='tableData0'):
         """ Parse the HTML output of the *current* browser page for a specific
@@ -89,20 +287,1243 @@ class CloudSitesCommon(object):
 
         RETURN: json object representing the JSON parsed screen
         """
-        html = self.browser.response().read()
-        match = re.search(r'^\s*' + varName + ':\n*\"(?P<value>.*?)",$', html, re.MULTILINE|re.DOTALL)
-        if match:
-            data = match.group(1).replace('\n','').replace(r'\"', '"').replace(r'\\"', r'\"')
+        html, parts, decoded = self._jsMemo()
+        if varName not in decoded:
+            span = parts.get(varName)
+            if span is None and not _tableDataName.match(varName):
+                # Not one of the tableDataN blocks collected by the page scan, search for it
+                match = _jsPattern('part', varName).search(html)
+                if match:
+                    span = match.span(1)
+            if span is None: # no match was found
+                raise CloudSitesError('ERROR: The JS var: ' + varName + ' was not found or there was a matching issue.')
+            started = time.time()
+            decoded[varName] = _decodeJsSpan(html, span[0], span[1], varName)
+            self._emit('parse', varName=varName, seconds=time.time() - started, bytes=span[1] - span[0])
+        return decoded[varName]
+
+    def _listPath(self, path):
+        """ Path of the first page of a listing, as opened by _listRows
+        """
+        return _pagedURL(path, {self.account.pageSizeParam: self.account.maxPageSize})
+
+    def _listRows(self, path, varNames=('tableData0',)):
+        """ Open a listing page and collect the rows of its tableDataN blocks across every page
+            The first page is asked for with the largest page size (Account.maxPageSize); if the
+            paging metadata of a block says there are more rows, the remaining pages are fetched
+            concurrently (Account.pageWorkers) and their rows appended in page order.
+            The panel pages every block of a page together (page N shows page N of each).
+                ARGS:
+                    - path - path or URL of the listing
+                    - varNames - blocks to collect
+
+            RETURN: list of rows for each of varNames
+        """
+        account = self.account
+        self._openPath(self._listPath(path))
+        try:
+            tables = [self._parseForJsVarPart(varName) for varName in varNames]
+        finally:
+            self._dropPage()
+        rows = [list(table['rows']) for table in tables]
+        pageCounts = [ ]
+        firstPage = 1
+        for table in tables:
+            total, pageSize, page = _pageInfo(table)
+            if page is not None:
+                firstPage = page
+            if total is None or len(table['rows']) >= total:
+                pageCounts.append(1)
+            else:
+                pageSize = pageSize or len(table['rows']) or 1
+                pageCounts.append(-(-total // pageSize))
+        if max(pageCounts) > 1:
+            paths = [_pagedURL(path, {account.pageSizeParam: account.maxPageSize, account.pageParam: page})
+                     for page in range(firstPage + 1, firstPage + max(pageCounts))]
+            pages = account._openPages(paths)
+            for offset, page in enumerate(pages):
+                for index, varName in enumerate(varNames):
+                    if offset + 1 < pageCounts[index]:
+                        rows[index].extend(page._parseForJsVarPart(varName)['rows'])
+                page._dropPage()
+        return rows
+
+
+########## Helpers ##########
+# Start of a "tableDataN:" block of a page (see CloudSitesCommon._jsMemo), up to the opening quote
+_jsVarPartPattern = re.compile(r'^\s*(?P<name>tableData\d+):\n*"', re.MULTILINE)
+_tableDataName = re.compile(r'tableData\d+$')
+# Compiled patterns of _parseForJsVar / _parseForJsVarPart: (kind, varName) -> pattern
+_jsPatterns = { }
+
+def _jsPattern(kind, varName):
+    """ Pattern finding "var varName = ...;" (kind 'var') or a "varName: "..."," part (kind 'part'),
+        compiled once per varName
+    """
+    pattern = _jsPatterns.get((kind, varName))
+    if pattern is None:
+        if kind == 'var':
+            pattern = re.compile(r'var\s+' + varName + r'\s*=\s*(?P<value>.*?);$', re.MULTILINE|re.DOTALL)
+        else:
+            pattern = re.compile(r'^\s*' + varName + ':\n*\"(?P<value>.*?)",$', re.MULTILINE|re.DOTALL)
+        _jsPatterns[(kind, varName)] = pattern
+    return pattern
+
+def _jsPartEnd(html, start):
+    """ End of the value of a "name: "..."," part starting at start: the first '",' ending
+        a line (as the lazy '"(.*?)",$' pattern would find it, without copying the value)
+
+        RETURN: offset of the closing quote (or -1)
+    """
+    end = html.find('",\n', start)
+    if end < 0 and html.endswith('",') and len(html) - 2 >= start:
+        end = len(html) - 2
+    return end
+
+def _decodeJsSpan(html, start, end, varName):
+    """ Decode the (escaped) JSON value of a JS variable found at html[start:end]
+        The value is copied out of the page once and unescaped in a single expression,
+        so the copy is gone before json.loads runs (a pass with nothing to replace, such
+        as the newline one on most pages, hands back the same string without copying)
+
+        RETURN: json object
+    """
+    data = html[start:end].replace('\n','').replace(r'\"', '"').replace(r'\\"', r'\"')
+    try:
+        # Try loading the data using the json parser
+        return json.loads(data)
+    except:
+        raise CloudSitesError('Error parsing JSON Data for var: ' + varName)
+
+def _pageInfo(table):
+    """ Paging metadata of a decoded tableDataN block
+
+        RETURN: (total number of rows, rows per page, page number), None for anything missing
+    """
+    def first(*keys):
+        for key in keys:
+            value = table.get(key)
+            if value not in (None, ''):
+                try:
+                    return int(value)
+                except (TypeError, ValueError):
+                    pass
+        return None
+    return (first('totalRows', 'totalCount', 'total', 'rowCount'),
+            first('pageSize', 'rowsPerPage', 'limit'),
+            first('page', 'pageNumber', 'currentPage'))
+
+def _pagedURL(path, params):
+    """ path with the given query parameters added (or replaced)
+    """
+    base, _, query = path.partition('?')
+    items = [(name, value) for name, value in urlparse.parse_qsl(query, True) if name not in params]
+    items.extend(sorted((name, str(value)) for name, value in params.items()))
+    return base + '?' + urllib.urlencode(items)
+
+def _domainKey(domain):
+    """ Index key of a domain name (lowercase, no trailing dot)
+    """
+    return domain.strip().rstrip('.').lower()
+
+def _domainSuffixes(domain):
+    """ A domain and every parent domain of it, e.g. www.example.com, example.com, com
+    """
+    labels = domain.split('.')
+    return ['.'.join(labels[index:]) for index in range(len(labels))]
+
+# Per thread request settings (e.g. the Scheduler priority of bulk crawl traffic)
+_requestContext = threading.local()
+
+def _requestPriority():
+    """ Scheduler priority of the requests made by the current thread
+    """
+    priority = getattr(_requestContext, 'priority', None)
+    return Scheduler.INTERACTIVE if priority is None else priority
+
+def _pageType(url):
+    """ Kind of page a URL is for, e.g. .../WebsiteFeatures.do?... -> WebsiteFeatures
+    """
+    return re.sub(r'\W', '', url.split('?')[0].rsplit('/', 1)[-1].replace('.do', '')) or 'page'
+
+def _rowHash(row):
+    """ Hash of a table row (to tell if it changed between two visits)
+    """
+    return hashlib.sha1(json.dumps(row, sort_keys=True)).hexdigest()
+
+def _runParallel(func, items, workers=4):
+    """ Call func(item) for every item using up to "workers" threads
+
+        RETURN: list of results (in the same order as items)
+        The first exception raised by func is re-raised once all threads are done.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    work = Queue.Queue()
+    for index, item in enumerate(items):
+        work.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = work.get_nowait()
+            except Queue.Empty:
+                return
             try:
-                # Try loading the data using the json parser
-                jsonData = json.loads(data)
-            except:
-                jsonData = False
-                raise CloudSitesError('Error parsing JSON Data for var: ' + varName)
-        else: # no match was found
-            jsonData = False
-            raise CloudSitesError('ERROR: The JS var: ' + varName + ' was not found or there was a matching issue.')
-        return jsonData
+                results[index] = func(item)
+            except Exception, e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, min(workers, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+########## _ListingPage ##########
+class _ListingPage(CloudSitesCommon):
+    """ One more page of a paged listing (see CloudSitesCommon._listRows)
+    """
+    __slots__ = ('_browser', 'cache', 'account', '_html', '_jsMemoData')
+
+    def __init__(self, account, browser):
+        self.account = account
+        self._browser = browser
+        self.cache = account.cache
+        self._html = None
+        self._jsMemoData = None
+        return
+
+
+########## _DatabaseDetailParser ##########
+class _DatabaseDetailParser(object):
+    """ Collects the (itemName, item) table cell pairs of a database (or cron job) detail page
+            A single linear pass over the html; can be fed in chunks. Outside the name and
+            item cells it jumps from one <td> tag to the next (nothing else matters there),
+            inside them every tag is looked at.
+            - the name is the text of a <td class="itemName"> cell (word chars/spaces only)
+            - the value is the text of the following <td class="item"> cell up to its first
+              tag other than <a>, or the href of the link if there is one
+    """
+    _tagPattern = re.compile(r'<(/?)([a-zA-Z][^\s/>]*)([^>]*)>')
+    # Opening <td> tags only, with the same groups as _tagPattern
+    _cellPattern = re.compile(r'<()([tT][dD])(?=[\s/>])([^>]*)>')
+    _classPattern = re.compile(r'\bclass\s*=\s*"([^"]*)"')
+    _hrefPattern = re.compile(r'\bhref="([^"]*)"')
+    _validName = re.compile(r'[\w\s]*$')
+
+    def __init__(self):
+        self.items = [ ]
+        self._pending = ''      # unfinished tag left over from the last chunk
+        self._name = None       # name waiting for its item cell
+        self._text = [ ]        # text collected for the current cell
+        self._href = None
+        self._inName = False
+        self._inItem = False
+        return
+
+    def feed(self, data):
+        """ Parse the next chunk of html
+            (the state lives in locals while looping: this runs once per tag of the cells)
+        """
+        data = self._pending + data
+        items = self.items
+        name, text, href = self._name, self._text, self._href
+        inName, inItem = self._inName, self._inItem
+        tagSearch = self._tagPattern.search
+        cellSearch = self._cellPattern.search
+        pos = 0
+        while True:
+            if inName or inItem:
+                match = tagSearch(data, pos)
+                if match is None:
+                    break
+                start = match.start()
+                if start > pos:
+                    text.append(data[pos:start])
+                isEnd, tag, attrs = match.groups()
+                tag = tag.lower()
+                if inName:
+                    if isEnd and tag == 'td':
+                        inName = False
+                        value = ''.join(text).strip()
+                        if self._validName.match(value):
+                            name = value
+                    else:
+                        # Only the text after the last tag counts as the name
+                        text = [ ]
+                elif tag != 'a':
+                    # Any other tag ends the item
+                    items.append((name, href if href is not None else ''.join(text).strip()))
+                    name = None
+                    inItem = False
+                elif not isEnd and href is None:
+                    hrefMatch = self._hrefPattern.search(attrs)
+                    if hrefMatch:
+                        href = hrefMatch.group(1)
+            else:
+                match = cellSearch(data, pos)
+                if match is None:
+                    break
+                isEnd, tag, attrs = match.groups()
+                tag = 'td'
+            pos = match.end()
+            if tag == 'td' and not isEnd:
+                classMatch = self._classPattern.search(attrs)
+                cssClass = classMatch.group(1) if classMatch else None
+                if cssClass == 'itemName':
+                    inName = True
+                    text = [ ]
+                elif cssClass == 'item' and name is not None and not inItem:
+                    inItem = True
+                    text = [ ]
+                    href = None
+        self._name, self._text, self._href = name, text, href
+        self._inName, self._inItem = inName, inItem
+        if not (inName or inItem):
+            # The text left over does not count, only a tag that may be split across chunks
+            cut = data.rfind('<', pos)
+            self._pending = data[cut:] if cut >= 0 else ''
+            return
+        rest = data[pos:]
+        cut = rest.rfind('<')
+        if cut >= 0:
+            # Might be the start of a tag split across chunks
+            self._pending = rest[cut:]
+            rest = rest[:cut]
+        else:
+            self._pending = ''
+        if rest:
+            text.append(rest)
+        return
+
+    def close(self):
+        """ Finish parsing (flushes anything left over)
+        """
+        if self._pending:
+            if self._inName or self._inItem:
+                self._text.append(self._pending)
+            self._pending = ''
+        return
+
+
+def _iterParallel(func, items, workers=4):
+    """ Like _runParallel, but yields each result as soon as it is ready
+        (in completion order). "items" may be a generator; it is consumed as workers free up.
+    """
+    items = iter(items)
+    itemsLock = threading.Lock()
+    results = Queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def worker():
+        try:
+            while not stop.is_set():
+                with itemsLock:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                try:
+                    results.put((func(item), None))
+                except Exception, e:
+                    results.put((None, e))
+                    return
+        finally:
+            results.put((done, None))
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, workers))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    running = len(threads)
+    try:
+        while running:
+            result, error = results.get()
+            if error is not None:
+                raise error
+            if result is done:
+                running -= 1
+            else:
+                yield result
+    finally:
+        # Stopped early (or failed): let the workers finish what they are doing and quit
+        stop.set()
+
+
+########## PageCache ##########
+class PageCache(object):
+    """ Cache of downloaded pages keyed by normalized URL
+            Entries expire after "ttl" seconds and the least recently used entries are
+            evicted once there are more than "maxEntries" of them.
+    """
+
+    def __init__(self, ttl=300, maxEntries=500):
+        """ INIT for PageCache
+                ARGS:
+                    - ttl - seconds an entry stays valid (None = forever)
+                    - maxEntries - maximum number of pages to keep
+        """
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    def _normalize(self, url):
+        """ Normalize a URL so equivalent URLs share an entry
+            (lowercase scheme/host, sorted query parameters, no fragment)
+        """
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        query = '&'.join(sorted(query.split('&'))) if query else ''
+        return urlparse.urlunsplit((scheme.lower(), netloc.lower(), path, query, ''))
+
+    def __contains__(self, url):
+        """ True if a valid entry for url is cached (does not count as a hit or miss)
+        """
+        with self._lock:
+            entry = self._entries.get(self._normalize(url))
+            return entry is not None and (self.ttl is None or time.time() - entry[0] <= self.ttl)
+
+    def get(self, url):
+        """ Return the cached html for url (or None)
+        """
+        key = self._normalize(url)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or (self.ttl is not None and time.time() - entry[0] > self.ttl):
+                self.misses += 1
+                return None
+            # Re-insert to mark it as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, url, html):
+        """ Store the html for url
+        """
+        if self.maxEntries < 1:
+            return
+        key = self._normalize(url)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), html)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+        return
+
+    def _withoutParams(self, key, params):
+        """ Normalized URL key with the given query parameters removed
+        """
+        base, _, query = key.partition('?')
+        query = '&'.join(item for item in query.split('&') if item and item.split('=', 1)[0] not in params)
+        return base + '?' + query if query else base
+
+    def invalidate(self, url, ignoreParams=()):
+        """ Forget the cached html for url
+                ARGS:
+                    - ignoreParams - query parameters to disregard, every entry matching url
+                      apart from those is forgotten as well (e.g. all pages of a listing)
+        """
+        key = self._normalize(url)
+        with self._lock:
+            self._entries.pop(key, None)
+            if ignoreParams:
+                key = self._withoutParams(key, ignoreParams)
+                for other in [other for other in self._entries
+                              if self._withoutParams(other, ignoreParams) == key]:
+                    del self._entries[other]
+        return
+
+    def clear(self):
+        """ Forget all cached pages
+        """
+        with self._lock:
+            self._entries.clear()
+        return
+
+    def __len__(self):
+        return len(self._entries)
+
+
+########## Prefetcher ##########
+class Prefetcher(object):
+    """ Background workers reading pages ahead into an account's page cache
+            See Account.enablePrefetch: once a website list or a features page is parsed,
+            the pages of its children are queued here, so the get* calls made on them later
+            are served from the cache. Requests run at bulk Scheduler priority, each worker
+            with a browser of its own.
+    """
+
+    def __init__(self, account, workers=4, maxPending=1000):
+        """ INIT for Prefetcher
+                ARGS:
+                    - account - Account whose cache is filled
+                    - workers - number of background threads
+                    - maxPending - most pages waiting to be fetched (more are not read ahead)
+        """
+        self.account = account
+        self.fetched = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue = Queue.Queue(maxPending)
+        self._pending = { }     # url -> Event set once it has been fetched (or given up on)
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work) for index in range(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        return
+
+    def add(self, paths):
+        """ Queue pages to be read ahead (those cached or queued already are skipped)
+        """
+        cache = self.account.cache
+        for path in paths:
+            url = self.account._buildURL(path)
+            with self._lock:
+                if url in self._pending or url in cache:
+                    continue
+                event = threading.Event()
+                try:
+                    self._queue.put_nowait((url, event))
+                except Queue.Full:
+                    self.dropped += 1
+                    continue
+                self._pending[url] = event
+        return
+
+    def wait(self, url, timeout=None):
+        """ Wait until url is fetched if it is queued or being fetched
+        """
+        event = self._pending.get(url)
+        if event is not None:
+            event.wait(timeout)
+        return
+
+    def _work(self):
+        _requestContext.priority = Scheduler.BULK
+        account = self.account
+        browser = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            url, event = item
+            try:
+                if url not in account.cache:
+                    if browser is None:
+                        browser = account._cloneBrowser()
+                    account._syncBrowser(browser)
+                    # force: skip the wait for this very page in _openPath
+                    _ListingPage(account, browser)._openPath(url, force=True)
+                    self.fetched += 1
+            except Exception:
+                # The call needing the page fetches it again (and reports the error)
+                self.errors += 1
+            finally:
+                with self._lock:
+                    self._pending.pop(url, None)
+                event.set()
+
+    def stop(self):
+        """ Forget the queued pages and stop the workers
+        """
+        while True:
+            try:
+                url, event = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            with self._lock:
+                self._pending.pop(url, None)
+            event.set()
+        for thread in self._threads:
+            self._queue.put(None)
+        return
+
+
+########## Snapshot ##########
+class Snapshot(object):
+    """ SQLite copy of an account's inventory
+            Used by Account.saveSnapshot / loadSnapshot / refreshSnapshot, but the tables can
+            be queried directly too, e.g.:
+                Snapshot(path).execute("SELECT domainName FROM websites JOIN databases USING (websiteID)"
+                                       " WHERE dbType = ?", ('MySQL 5',))
+    """
+    # The *Loaded columns say whether the child set was loaded when the snapshot was written
+    # (0: it is left to load on first access; NULL: written before they were kept, as loaded);
+    # a NULL detail was not loaded either
+    _schema = """
+        CREATE TABLE IF NOT EXISTS clients (
+            clientID TEXT PRIMARY KEY, name TEXT, url TEXT, rowHash TEXT,
+            websitesLoaded INTEGER, usersLoaded INTEGER);
+        CREATE TABLE IF NOT EXISTS ftpUsers (
+            clientID TEXT, userName TEXT, userID TEXT, name TEXT, accessLevel TEXT,
+            PRIMARY KEY (clientID, userName));
+        CREATE TABLE IF NOT EXISTS websites (
+            websiteID TEXT PRIMARY KEY, clientID TEXT, name TEXT, url TEXT, domainName TEXT,
+            rowHash TEXT, cronList TEXT, databasesLoaded INTEGER);
+        CREATE TABLE IF NOT EXISTS databases (
+            websiteID TEXT, name TEXT, dbType TEXT, url TEXT, detail TEXT, usersLoaded INTEGER,
+            PRIMARY KEY (websiteID, name));
+        CREATE TABLE IF NOT EXISTS databaseUsers (
+            websiteID TEXT, databaseName TEXT, userName TEXT, url TEXT,
+            PRIMARY KEY (websiteID, databaseName, userName));
+        CREATE TABLE IF NOT EXISTS cronJobs (
+            websiteID TEXT, name TEXT, url TEXT, detail TEXT, jobID TEXT);
+        CREATE INDEX IF NOT EXISTS websitesByClient ON websites (clientID);
+        CREATE INDEX IF NOT EXISTS websitesByDomain ON websites (domainName);
+        CREATE INDEX IF NOT EXISTS databasesByType ON databases (dbType);
+    """
+    # Columns added since the first snapshots were written: (table, column, type)
+    _addedColumns = [('cronJobs', 'detail', 'TEXT'), ('clients', 'websitesLoaded', 'INTEGER'),
+                     ('clients', 'usersLoaded', 'INTEGER'), ('websites', 'databasesLoaded', 'INTEGER'),
+                     ('databases', 'usersLoaded', 'INTEGER'), ('cronJobs', 'jobID', 'TEXT')]
+
+    def __init__(self, path):
+        """ INIT for Snapshot
+                ARGS:
+                    - path - SQLite file (created if needed)
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self._schema)
+        # Bring older snapshots up to the current schema
+        for table, column, columnType in self._addedColumns:
+            if column not in [info[1] for info in self.execute('PRAGMA table_info(' + table + ')')]:
+                self.db.execute('ALTER TABLE ' + table + ' ADD COLUMN ' + column + ' ' + columnType)
+        return
+
+    def close(self):
+        self.db.close()
+        return
+
+    def execute(self, sql, params=()):
+        """ Run a query against the snapshot - RETURN: list of rows
+        """
+        return self.db.execute(sql, params).fetchall()
+
+    def store(self, account):
+        """ Replace the snapshot contents with the account's loaded object graph
+        """
+        with self.db:
+            for table in ('clients', 'ftpUsers', 'websites', 'databases', 'databaseUsers', 'cronJobs'):
+                self.db.execute('DELETE FROM ' + table)
+            for client in account.clientList.itervalues():
+                self.db.execute('INSERT INTO clients (clientID, name, url, rowHash, websitesLoaded, usersLoaded)'
+                                ' VALUES (?, ?, ?, ?, ?, ?)',
+                                (client.clientID, client.name, client.url, client.rowHash,
+                                 client._websites is not None, client._users is not None))
+                self.db.executemany('INSERT INTO ftpUsers VALUES (?, ?, ?, ?, ?)',
+                                    [(client.clientID, userName) + tuple(user)
+                                     for userName, user in (client._users or { }).iteritems()])
+                # Only what is loaded goes in, nothing is fetched from here
+                for website in client._children():
+                    cronList = json.dumps(website._cronList) if website._cronList is not None else None
+                    self.db.execute('INSERT INTO websites (websiteID, clientID, name, url, domainName, rowHash,'
+                                    ' cronList, databasesLoaded) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                    (website.websiteID, client.clientID, website.name, website.url,
+                                     website.domainName, website.rowHash, cronList,
+                                     website._databaseList is not None))
+                    self.db.executemany('INSERT INTO cronJobs (websiteID, jobID, name, url, detail)'
+                                        ' VALUES (?, ?, ?, ?, ?)',
+                                        [(website.websiteID, job.jobID, job.name, job.url,
+                                          json.dumps(job._detail) if job._detail is not None else None)
+                                         for job in (website._cronJobs or { }).itervalues()])
+                    for db in (website._databaseList or { }).itervalues():
+                        detail = json.dumps(db._detail) if db._detail is not None else None
+                        self.db.execute('INSERT INTO databases (websiteID, name, dbType, url, detail, usersLoaded)'
+                                        ' VALUES (?, ?, ?, ?, ?, ?)',
+                                        (website.websiteID, db.name, db.dbType, db.url, detail,
+                                         db._users is not None))
+                        self.db.executemany('INSERT INTO databaseUsers VALUES (?, ?, ?, ?)',
+                                            [(website.websiteID, db.name, userName, url)
+                                             for userName, url in (db._users or { }).iteritems()])
+        return
+
+    def load(self, account):
+        """ Rebuild the account's object graph from the snapshot (adds to account.clientList)
+            What was not loaded when it was written is left to load on first access again.
+        """
+        for clientID, name, url, rowHash, websitesLoaded, usersLoaded in self.execute(
+                'SELECT clientID, name, url, rowHash, websitesLoaded, usersLoaded FROM clients'):
+            client = Client(account, clientID, name, url)
+            client.rowHash = rowHash
+            if websitesLoaded != 0:
+                client.websites = { }
+            if usersLoaded != 0:
+                client.users = { }
+            account.clientList[client.clientID] = client
+        for clientID, userName, userID, name, accessLevel in self.execute(
+                'SELECT clientID, userName, userID, name, accessLevel FROM ftpUsers'):
+            account.clientList[clientID]._users[userName] = (userID, name, accessLevel)
+        websites = { }
+        for websiteID, clientID, name, url, domainName, rowHash, cronList, databasesLoaded in self.execute(
+                'SELECT websiteID, clientID, name, url, domainName, rowHash, cronList, databasesLoaded FROM websites'):
+            client = account.clientList[clientID]
+            website = Website(client, websiteID, name, url, domainName)
+            website.rowHash = rowHash
+            if databasesLoaded != 0:
+                website.databaseList = { }
+            website.cronList = json.loads(cronList) if cronList is not None else None
+            client._websites[website.websiteID] = website
+            websites[website.websiteID] = website
+        for websiteID, name, dbType, url, detail, usersLoaded in self.execute(
+                'SELECT websiteID, name, dbType, url, detail, usersLoaded FROM databases'):
+            website = websites[websiteID]
+            db = Database(website, name, dbType, url)
+            if detail is not None:
+                db.detail = json.loads(detail)
+            if usersLoaded != 0:
+                db.users = { }
+            website._databaseList[name] = db
+        for websiteID, databaseName, userName, url in self.execute(
+                'SELECT websiteID, databaseName, userName, url FROM databaseUsers'):
+            websites[websiteID]._databaseList[databaseName]._users[userName] = url
+        for websiteID, jobID, name, url, detail in self.execute(
+                'SELECT websiteID, jobID, name, url, detail FROM cronJobs WHERE detail IS NOT NULL'):
+            website = websites[websiteID]
+            if website._cronJobs is None:
+                continue
+            if jobID is not None:
+                job = website._cronJobs.get(jobID)
+            else:
+                # Written before the jobID was kept
+                job = website.getCronJob(name)
+            if job is not None:
+                job.detail = json.loads(detail)
+        return
+
+
+########## Diff ##########
+def _diffNode(kind, value):
+    """ Own record and children of an inventory node
+            Clients, websites, databases and cron jobs are objects, FTP users and database
+            users are plain values (their own record). A record field or child set that is
+            not loaded is None: unknown, it is not compared with the other side.
+
+        RETURN: (record, {child kind: {key: child} or None})
+    """
+    if kind == 'client':
+        return ({'name': value.name, 'url': value.url},
+                {'ftpUser': value._users, 'website': value._websites})
+    if kind == 'website':
+        return ({'name': value.name, 'url': value.url, 'domainName': value.domainName},
+                {'database': value._databaseList, 'cronJob': value._cronJobs})
+    if kind == 'database':
+        return ({'dbType': value.dbType, 'url': value.url, 'detail': value._detail},
+                {'databaseUser': value._users})
+    if kind == 'cronJob':
+        return {'name': value.name, 'url': value.url, 'detail': value._detail}, { }
+    return value, { }
+
+def _merkleHash(kind, value, memo):
+    """ Hash of a node's record rolled up with the hashes of all its loaded children
+        (memo: id(object) -> hash, so every node is hashed once per diff)
+        Equal hashes mean equal subtrees; when one side has loaded more than the other the
+        hashes differ and _diffTree compares what both sides have.
+    """
+    key = id(value)
+    if key not in memo:
+        record, children = _diffNode(kind, value)
+        memo[key] = _rowHash([_rowHash(record),
+                              sorted([childKind, childKey, _merkleHash(childKind, child, memo)]
+                                     for childKind, items in children.iteritems() if items is not None
+                                     for childKey, child in items.iteritems())])
+    return memo[key]
+
+def _diffTree(kind, path, old, new, oldMemo, newMemo, changes):
+    """ Append the changes between two versions of a node (skipping identical subtrees)
+    """
+    if _merkleHash(kind, old, oldMemo) == _merkleHash(kind, new, newMemo):
+        return
+    oldRecord, oldChildren = _diffNode(kind, old)
+    newRecord, newChildren = _diffNode(kind, new)
+    if _rowHash(oldRecord) != _rowHash(newRecord):
+        fields = None
+        if isinstance(oldRecord, dict):
+            # Fields not loaded on one side are unknown, not changed
+            fields = sorted(field for field in set(oldRecord) | set(newRecord)
+                            if oldRecord.get(field) is not None and newRecord.get(field) is not None
+                            and _rowHash(oldRecord.get(field)) != _rowHash(newRecord.get(field)))
+        if fields is None or fields:
+            changes.append({'change': 'modified', 'type': kind, 'path': path, 'fields': fields})
+    for childKind in sorted(set(oldChildren) | set(newChildren)):
+        oldItems = oldChildren.get(childKind)
+        newItems = newChildren.get(childKind)
+        if oldItems is None or newItems is None:
+            # Not loaded on one side: nothing to compare
+            continue
+        for key in sorted(set(oldItems) | set(newItems)):
+            childPath = path + '/' + key if path else key
+            if key not in newItems:
+                changes.append({'change': 'removed', 'type': childKind, 'path': childPath, 'fields': None})
+            elif key not in oldItems:
+                changes.append({'change': 'added', 'type': childKind, 'path': childPath, 'fields': None})
+            else:
+                _diffTree(childKind, childPath, oldItems[key], newItems[key], oldMemo, newMemo, changes)
+    return
+
+def diffAccounts(old, new):
+    """ Changes between two crawls of an account (what is loaded in both is compared)
+            Every record is hashed and the hashes are rolled up (Merkle style) per website and
+            per client, so unchanged clients/websites are skipped with one comparison.
+            ARGS:
+                - old, new - Account objects or snapshot files (see Account.saveSnapshot)
+
+        RETURN: list of dicts: change ('added', 'removed' or 'modified'), type ('client',
+                'ftpUser', 'website', 'database', 'databaseUser' or 'cronJob'), path
+                (e.g. clientID/websiteID/databaseName/userName) and fields (changed fields
+                of a modified client, website, database or cron job, otherwise None)
+    """
+    accounts = [ ]
+    for account in (old, new):
+        if isinstance(account, basestring):
+            path, account = account, Account(cacheSize=0)
+            account.loadSnapshot(path)
+        accounts.append(account)
+    old, new = accounts
+    changes = [ ]
+    oldMemo, newMemo = { }, { }
+    for clientID in sorted(set(old.clientList) | set(new.clientList)):
+        if clientID not in new.clientList:
+            changes.append({'change': 'removed', 'type': 'client', 'path': clientID, 'fields': None})
+        elif clientID not in old.clientList:
+            changes.append({'change': 'added', 'type': 'client', 'path': clientID, 'fields': None})
+        else:
+            _diffTree('client', clientID, old.clientList[clientID], new.clientList[clientID],
+                      oldMemo, newMemo, changes)
+    return changes
+
+
+########## Pooled Transport ##########
+class ConnectionPool(object):
+    """ Idle keep-alive HTTP(S) connections, per (scheme, host)
+    """
+
+    def __init__(self, maxIdle=8):
+        """ INIT for ConnectionPool
+                ARGS:
+                    - maxIdle - maximum number of idle connections kept per host
+        """
+        self.maxIdle = maxIdle
+        self._idle = { }
+        self._lock = threading.Lock()
+        return
+
+    def get(self, key):
+        """ An idle connection for key (or None)
+        """
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop()
+        return None
+
+    def put(self, key, connection):
+        """ Give a connection back for reuse
+        """
+        with self._lock:
+            connections = self._idle.setdefault(key, [ ])
+            if len(connections) < self.maxIdle:
+                connections.append(connection)
+                return
+        connection.close()
+        return
+
+    def clear(self):
+        """ Close every idle connection
+        """
+        with self._lock:
+            idle, self._idle = self._idle, { }
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+        return
+
+
+class _PooledHandlerMixin(object):
+    """ do_open() replacement for mechanize's HTTP(S) handlers that keeps connections
+        alive (in a ConnectionPool, shared by every browser using these handlers) and
+        asks for gzip/deflate compressed pages.
+        Bodies are read completely (and decompressed) before the response is handed to
+        mechanize, so forms and everything else work as with the default handlers.
+    """
+    pool = ConnectionPool()
+
+    def do_open(self, http_class, req):
+        if getattr(req, '_tunnel_host', None):
+            # Proxy tunnels are left to mechanize
+            return super(_PooledHandlerMixin, self).do_open(http_class, req)
+        host = req.get_host()
+        if not host:
+            raise mechanize.URLError('no host given')
+        key = (req.get_type(), host)
+        headers = dict((str(name.title()), str(value)) for name, value in req.headers.items())
+        headers.update((str(name.title()), str(value)) for name, value in req.unredirected_hdrs.items())
+        headers['Connection'] = 'keep-alive'
+        headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        finalize = getattr(self.parent, 'finalize_request_headers', None)
+        if finalize is not None:
+            finalize(req, headers)
+
+        connection = self.pool.get(key)
+        reused = connection is not None
+        while True:
+            try:
+                if connection is None:
+                    connection = http_class(host, timeout=req.timeout)
+                    connection.connect()
+                    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                connection.request(str(req.get_method()), str(req.get_selector()), req.data, headers)
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (socket.error, httplib.HTTPException), e:
+                if connection is not None:
+                    connection.close()
+                connection = None
+                if not reused:
+                    raise mechanize.URLError(e)
+                # The server closed the idle connection, try once more on a new one
+                reused = False
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(key, connection)
+
+        msg = response.msg
+        encoding = (msg.getheader('content-encoding') or '').strip().lower()
+        if encoding in ('gzip', 'deflate'):
+            if encoding == 'gzip':
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            else:
+                try:
+                    body = zlib.decompress(body)
+                except zlib.error:
+                    body = zlib.decompress(body, -zlib.MAX_WBITS)
+            del msg['content-encoding']
+            del msg['content-length']
+            msg['Content-Length'] = str(len(body))
+        return mechanize._response.closeable_response(
+            StringIO(body), msg, req.get_full_url(), response.status, response.reason)
+
+
+# mechanize.Browser subclass using the pooled handlers (built by _pooledBrowserClass)
+_PooledBrowser = None
+
+def _pooledBrowserClass():
+    """ mechanize.Browser using the keep-alive, compressed transport (see Account pooledTransport)
+        (the classes are built on first use, so mechanize is only imported when needed)
+    """
+    global _PooledBrowser
+    if _PooledBrowser is None:
+        # class statements (not type()): mechanize.Browser is an old-style class
+
+        class _PooledHTTPHandler(_PooledHandlerMixin, mechanize.HTTPHandler):
+            pass
+
+        class _PooledHTTPSHandler(_PooledHandlerMixin, mechanize.HTTPSHandler):
+            pass
+
+        class _PooledBrowser(mechanize.Browser):
+            """ mechanize.Browser using the keep-alive, compressed transport (see Account pooledTransport)
+            """
+            handler_classes = dict(mechanize.Browser.handler_classes,
+                                   http=_PooledHTTPHandler, https=_PooledHTTPSHandler)
+    return _PooledBrowser
+
+
+class _NoHistory(object):
+    """ mechanize browser history keeping nothing: the default one holds on to every
+        response (page included) for back(), which is never used here
+    """
+
+    def add(self, request, response):
+        return
+
+    def back(self, n, _response):
+        raise mechanize.BrowserStateError("already at start of history")
+
+    def clear(self):
+        return
+
+    def close(self):
+        return
+
+
+########## Scheduler ##########
+class Scheduler(object):
+    """ Paces control panel requests (see Account.scheduler); may be shared by several accounts
+            - a token bucket limits the request rate (rate per second, up to "burst" at once)
+            - the number of requests in flight adapts AIMD-style: it grows by one per
+              "concurrency" good responses and is halved on an error, a login page bounce or
+              a response slower than targetLatency
+            - waiting interactive requests go before waiting bulk (crawl) requests
+    """
+    INTERACTIVE = 0
+    BULK = 1
+
+    def __init__(self, rate=10.0, burst=None, minConcurrency=1, maxConcurrency=16, targetLatency=2.0):
+        """ INIT for Scheduler
+                ARGS:
+                    - rate - requests per second
+                    - burst - size of the token bucket (defaults to rate)
+                    - minConcurrency / maxConcurrency - bounds for the number of requests in flight
+                    - targetLatency - seconds; slower responses count as a sign of overload
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.minConcurrency = minConcurrency
+        self.maxConcurrency = maxConcurrency
+        self.targetLatency = targetLatency
+        self.concurrency = float(minConcurrency)
+        self.inFlight = 0
+        self._tokens = self.burst
+        self._refilled = time.time()
+        self._waiting = [ ]     # heap of (priority, sequence)
+        self._sequence = 0
+        self._condition = threading.Condition()
+        return
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        return
+
+    def acquire(self, priority=INTERACTIVE):
+        """ Wait for our turn to send a request (always pair with release())
+            RETURN: seconds waited
+        """
+        started = time.time()
+        with self._condition:
+            self._sequence += 1
+            ticket = (priority, self._sequence)
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                self._refill()
+                if self._waiting[0] == ticket and self.inFlight < int(self.concurrency):
+                    if self._tokens >= 1:
+                        break
+                    # Wait for the next token
+                    self._condition.wait((1 - self._tokens) / self.rate)
+                else:
+                    self._condition.wait()
+            heapq.heappop(self._waiting)
+            self._tokens -= 1
+            self.inFlight += 1
+            self._condition.notify_all()
+        return time.time() - started
+
+    def release(self, seconds, ok=True):
+        """ Report a finished request
+                ARGS:
+                    - seconds - how long it took
+                    - ok - False for errors and login page bounces
+        """
+        with self._condition:
+            self.inFlight -= 1
+            if not ok or seconds > self.targetLatency:
+                self.concurrency = max(self.minConcurrency, self.concurrency / 2)
+            else:
+                self.concurrency = min(self.maxConcurrency, self.concurrency + 1 / self.concurrency)
+            self._condition.notify_all()
+        return
+
+
+########## Stats ##########
+class Stats(object):
+    """ Collects instrumentation events (use as a hook: account.addHook(Stats())) and
+        aggregates them per event and page type / varName:
+        count, total/min/max seconds, bytes and a histogram of durations.
+    """
+    # Histogram bucket upper bounds, in milliseconds (the last bucket is open ended)
+    buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+        return
+
+    def reset(self):
+        """ Forget everything collected so far
+        """
+        with self._lock:
+            self.entries = { }
+        return
+
+    def __call__(self, event, data):
+        key = (event, data.get('pageType') or data.get('varName') or data.get('action') or '')
+        seconds = data.get('seconds', 0.0)
+        milliseconds = seconds * 1000
+        bucket = len(self.buckets)
+        for index, bound in enumerate(self.buckets):
+            if milliseconds <= bound:
+                bucket = index
+                break
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = {'count': 0, 'seconds': 0.0, 'min': None, 'max': 0.0,
+                                             'bytes': 0, 'openSeconds': 0.0, 'readSeconds': 0.0,
+                                             'histogram': [0] * (len(self.buckets) + 1)}
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['min'] = seconds if entry['min'] is None else min(entry['min'], seconds)
+            entry['max'] = max(entry['max'], seconds)
+            entry['bytes'] += data.get('bytes', 0)
+            entry['openSeconds'] += data.get('openSeconds', 0.0)
+            entry['readSeconds'] += data.get('readSeconds', 0.0)
+            entry['histogram'][bucket] += 1
+        return
+
+    def summary(self):
+        """ RETURN: {event: {pageType or varName: {count, seconds, mean, min, max, bytes, ...}}}
+        """
+        result = { }
+        with self._lock:
+            for (event, name), entry in self.entries.items():
+                entry = dict(entry, histogram=list(entry['histogram']))
+                entry['mean'] = entry['seconds'] / entry['count']
+                result.setdefault(event, { })[name] = entry
+        return result
+
+    def histogram(self, event, name):
+        """ RETURN: list of (bucket label, count) for one event / page type
+        """
+        entry = self.summary().get(event, { }).get(name)
+        if entry is None:
+            return [ ]
+        labels = ['<=%dms' % bound for bound in self.buckets] + ['>%dms' % self.buckets[-1]]
+        return zip(labels, entry['histogram'])
+
+    def report(self):
+        """ RETURN: the summary as a printable table
+        """
+        lines = ['%-9s %-20s %7s %10s %9s %9s %9s %12s' % (
+            'event', 'page/var', 'count', 'total s', 'mean ms', 'min ms', 'max ms', 'bytes')]
+        for event, names in sorted(self.summary().items()):
+            for name, entry in sorted(names.items()):
+                lines.append('%-9s %-20s %7d %10.3f %9.2f %9.2f %9.2f %12d' % (
+                    event, name[:20], entry['count'], entry['seconds'], entry['mean'] * 1000,
+                    entry['min'] * 1000, entry['max'] * 1000, entry['bytes']))
+        return '\n'.join(lines)
+
+
+########## PageRecorder ##########
+class PageRecorder(object):
+    """ Saves the pages fetched by _openPath as sanitized fixtures
+            (for benchmarks/standin.py to serve). Set Account.recorder to use it.
+            Every page is written to its own file in "directory"; index.json maps the
+            path (and query) it was fetched from to the file name.
+
+            Sanitizing replaces the base URL with {{baseURL}}, the account login, name and ID
+            with demo values, e-mail addresses with user@example.com and any extra
+            (text -> replacement) pairs given.
+    """
+    _emailPattern = re.compile(r'[\w.+-]+@[\w-]+(\.[\w-]+)+')
+
+    def __init__(self, directory, replacements=None):
+        """ INIT for PageRecorder
+                ARGS:
+                    - directory - where to write the fixtures (created if needed)
+                    - replacements - optional dict of extra text -> replacement to sanitize
+        """
+        self.directory = directory
+        self.replacements = dict(replacements or { })
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._indexPath = os.path.join(directory, 'index.json')
+        self.index = { }
+        if os.path.exists(self._indexPath):
+            with open(self._indexPath) as f:
+                self.index = json.load(f)
+        return
+
+    def sanitize(self, account, text):
+        """ Remove account specific details from text
+        """
+        replacements = [(account.baseURL, '{{baseURL}}')]
+        for attr, demo in (('accountName', 'Demo Account'), ('accountLogin', 'demo'), ('accountID', '100000')):
+            value = getattr(account, attr, None)
+            if value:
+                replacements.append((value, demo))
+        replacements.extend(self.replacements.items())
+        for value, replacement in replacements:
+            text = text.replace(value, replacement)
+        return self._emailPattern.sub('user@example.com', text)
+
+    def record(self, account, url, html):
+        """ Save the html fetched from url
+        """
+        path = url[len(account.baseURL):] if url.startswith(account.baseURL) else url
+        path = self.sanitize(account, path)
+        pageType = _pageType(url)
+        with self._lock:
+            filename = self.index.get(path) or '%05d-%s.html' % (len(self.index), pageType)
+            with open(os.path.join(self.directory, filename), 'w') as f:
+                f.write(self.sanitize(account, html))
+            self.index[path] = filename
+            with open(self._indexPath, 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+        return
+
+
+########## _BulkJournal ##########
+class _BulkJournal(object):
+    """ Progress journal of Account.bulkDatabaseUsers (one JSON line per finished job)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Half written line of an interrupted run
+                        continue
+                    if entry.get('status') == 'done':
+                        self._done.add(self._key(entry))
+        self._file = open(path, 'a')
+        return
+
+    def _key(self, entry):
+        return (entry['action'], entry['database'], entry['username'])
+
+    def isDone(self, result):
+        """ True if the journal says the job of result was done already
+        """
+        return self._key(result) in self._done
+
+    def record(self, result):
+        """ Write down a finished job (flushed to disk before returning)
+        """
+        with self._lock:
+            self._file.write(json.dumps(dict(result, time=time.time()), sort_keys=True) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if result['status'] == 'done':
+                self._done.add(self._key(result))
+        return
+
+    def close(self):
+        self._file.close()
+        return
 
 
 ########## CloudSitesError CLASS ##########
@@ -115,37 +1536,253 @@ class CloudSitesError(Exception):
         return(repr(self.value))
 
 
+########## BulkPlan ##########
+class BulkPlan(object):
+    """ What Account.bulkDatabaseUsers would do with a list of jobs (see Account.planDatabaseUsers)
+            Each database costs, one job after the other:
+                - createUser: 2 requests (database page, form submit), 1 when it follows a job that
+                  went through on the same database (its response is the database page, with
+                  the add user form; the page is loaded again if the form is missing)
+                - changePassword: 2 requests (user page, form submit), plus 1 for the database
+                  page if its users are not loaded yet (and no earlier job loaded them);
+                  none for a user the loaded users do not have (it fails straight away)
+            Estimates assume every other job goes through.
+    """
+    # Seconds per request when nothing better is known
+    secondsPerRequest = 0.5
+
+    def __init__(self, account, jobs, workers=4, secondsPerRequest=None):
+        """ INIT for BulkPlan
+                ARGS:
+                    - account - Account object the jobs are for
+                    - jobs - as for Account.bulkDatabaseUsers
+                    - workers - number of databases worked on concurrently
+                    - secondsPerRequest - estimated seconds per request (None = measured / default)
+        """
+        self.account = account
+        self.jobs = list(jobs)
+        self.workers = workers
+        if secondsPerRequest is None:
+            secondsPerRequest = self._measuredSecondsPerRequest()
+        self.secondsPerRequest = secondsPerRequest
+        self.items = [ ]
+        self.unresolved = [ ]
+        self.databases = OrderedDict()
+        self._plan()
+        return
+
+    def _measuredSecondsPerRequest(self):
+        """ Mean request time (page loads and form submits) collected by the account's Stats
+            hooks (or the class default)
+        """
+        count = 0
+        seconds = 0.0
+        for hook in self.account.hooks:
+            if isinstance(hook, Stats):
+                for entry in hook.summary().get('request', { }).values():
+                    count += entry['count']
+                    seconds += entry['seconds']
+        return seconds / count if count else BulkPlan.secondsPerRequest
+
+    def _plan(self):
+        for database, username, password, action in self.account._parseUserJobs(self.jobs):
+            item = {'action': action, 'database': getattr(database, 'name', database),
+                    'username': username, 'requests': 0, 'naiveRequests': 0, 'notes': [ ]}
+            self.items.append(item)
+            if not isinstance(database, Database):
+                item['notes'].append('database not found')
+                self.unresolved.append(item)
+                continue
+            entry = self.databases.get(database.name)
+            if entry is None:
+                entry = self.databases[database.name] = {'database': database, 'requests': 0,
+                                                         'naiveRequests': 0, 'onPage': False,
+                                                         'usersLoaded': database._users is not None,
+                                                         'created': set()}
+            if action == 'createUser':
+                item['requests'] = 1 if entry['onPage'] else 2
+                item['naiveRequests'] = 2
+                if entry['onPage']:
+                    item['notes'].append('reuses the database page')
+                entry['usersLoaded'] = True
+                entry['created'].add(item['username'])
+            else:
+                if not entry['usersLoaded']:
+                    item['requests'] = item['naiveRequests'] = 1
+                    item['notes'].append('loads the database users')
+                    entry['usersLoaded'] = True
+                elif database._users is not None and item['username'] not in database._users \
+                        and item['username'] not in entry['created']:
+                    # Fails before making a request
+                    item['notes'].append('unknown user')
+                    entry['onPage'] = False
+                    continue
+                item['requests'] += 2
+                item['naiveRequests'] += 2
+            entry['onPage'] = True
+            entry['requests'] += item['requests']
+            entry['naiveRequests'] += item['naiveRequests']
+        return
+
+    @property
+    def requests(self):
+        """ Number of requests the plan makes
+        """
+        return sum(item['requests'] for item in self.items)
+
+    @property
+    def naiveRequests(self):
+        """ Number of requests the jobs would take without sharing the database page loads
+        """
+        return sum(item['naiveRequests'] for item in self.items)
+
+    @property
+    def estimatedSeconds(self):
+        """ Estimated duration: the databases run "workers" at a time (the longest one at least),
+            no faster than the account's Scheduler rate allows
+        """
+        chains = [entry['requests'] for entry in self.databases.values()]
+        if not chains:
+            return 0.0
+        seconds = max(max(chains), float(sum(chains)) / max(1, self.workers)) * self.secondsPerRequest
+        scheduler = self.account.scheduler
+        if scheduler is not None:
+            seconds = max(seconds, sum(chains) / scheduler.rate)
+        return seconds
+
+    def summary(self):
+        """ RETURN: dict with jobs, databases, unresolved, requests, naiveRequests,
+                    secondsPerRequest and estimatedSeconds
+        """
+        return {'jobs': len(self.items), 'databases': len(self.databases), 'unresolved': len(self.unresolved),
+                'requests': self.requests, 'naiveRequests': self.naiveRequests,
+                'secondsPerRequest': self.secondsPerRequest, 'estimatedSeconds': self.estimatedSeconds}
+
+    def report(self):
+        """ RETURN: the plan as printable text
+        """
+        lines = ['%-15s %-20s %-10s %8s  %s' % ('action', 'database', 'username', 'requests', 'notes')]
+        for item in self.items:
+            lines.append('%-15s %-20s %-10s %8d  %s' % (item['action'], item['database'][:20], item['username'],
+                                                       item['requests'], ', '.join(item['notes'])))
+        summary = self.summary()
+        lines.append('%(jobs)d jobs on %(databases)d databases (%(unresolved)d not found): '
+                     '%(requests)d requests (%(naiveRequests)d without shared page loads), '
+                     'about %(estimatedSeconds).1f s at %(secondsPerRequest).2f s/request' % summary)
+        return '\n'.join(lines)
+
+    def run(self, journal=None):
+        """ Carry out the plan (see Account.bulkDatabaseUsers)
+            RETURN: list of result dicts (in the order of the jobs)
+        """
+        return self.account.bulkDatabaseUsers(self.jobs, self.workers, journal)
+
+
+
 ########## Account ##########
 class Account(CloudSitesCommon):
     """ Rackspace Cloud Sites Account
             This is the starting point, first you must have an account with Rackspace to login to.
     """
 
-    def __init__(self):
-        """ INIT for CloudSites (what to put here?)
+    # Number of times a request is retried after logging in again, and the delay
+    # (in seconds, doubled on every retry) before each retry
+    reloginRetries = 3
+    reloginBackoff = 1.0
+    # Maximum number of clients/websites/databases keeping their loaded children
+    # (the least recently loaded ones are unloaded beyond that); None = no limit
+    childBudget = None
+    # PageRecorder saving every fetched page as a fixture (None = not recording)
+    recorder = None
+    # Scheduler pacing the requests (None = no pacing); set Account.scheduler to share
+    # one between every Account, or account.scheduler for a single one
+    scheduler = None
+    # Paging of the tableDataN listings: query parameters, the largest page size to ask
+    # for, and how many of the remaining pages are fetched at once
+    pageParam = 'page'
+    pageSizeParam = 'pageSize'
+    maxPageSize = 500
+    pageWorkers = 4
+
+    def __init__(self, cacheTTL=300, cacheSize=500, credentials=None, pooledTransport=False):
+        """ INIT for CloudSites
+                ARGS:
+                    - cacheTTL - seconds a downloaded page may be reused (see PageCache)
+                    - cacheSize - maximum number of cached pages (0 disables the cache)
+                    - credentials - optional callable returning (username, password), used to
+                      login (again) when login() is called without them or the session times out
+                    - pooledTransport - use keep-alive connections (shared between all browsers)
+                      and gzip/deflate compression instead of mechanize's default handlers
         """
-        self.browser = mechanize.Browser()
+        self.pooledTransport = pooledTransport
+        self.account = self
+        self.credentials = credentials
+        self.sessionFile = None
+        self._username = None
+        self._password = None
+        self._session = 0
+        self._browserSessions = { }
+        self._reloginLock = threading.Lock()
+        self._loadedObjects = OrderedDict()
+        self._loadedLock = threading.Lock()
+        self.hooks = [ ]
+        self.cache = PageCache(cacheTTL, cacheSize)
+        self.prefetcher = None
+        # The browser and its cookie jar are created on first use (see browser)
+        self._browser = None
+        self._cookieJar = None
+        self._browserLock = threading.Lock()
         self.clientList = { }
         self.authenticated = False
+        self._idleBrowsers = Queue.Queue()
+        # Lookup indexes over the loaded objects (see findWebsite etc): key -> (id(owner), object)
+        self._indexes = {'domain': { }, 'ftpUser': { }, 'databaseUser': { }}
+        self._domainSuffixIndex = { }   # domain or parent domain -> {id(website): website}
+        self._indexedKeys = { }         # (kind, id(owner)) -> keys owner put in that index
+        self._indexLock = threading.Lock()
         return
 
-    def login(self,username, password):
+    def login(self,username=None, password=None, sessionFile=None):
         """ Login to the url, using the provided username and password
 
         Args:
             username
             password
+            (if not given, the credentials callable passed to Account() is asked for them)
+            sessionFile - reuse the session saved in this file if it is still valid, and
+                          save the session there after logging in (see saveSession)
 
         Returns: True or False
         """
+        if sessionFile is not None:
+            self.sessionFile = sessionFile
+            if self.loadSession(sessionFile):
+                # Still remember the credentials in case the saved session times out
+                if username is not None:
+                    self._username = username
+                    self._password = password
+                return True
+        if username is None and self.credentials is not None:
+            username, password = self.credentials()
+        # Remember them to login again if the session times out
+        self._username = username
+        self._password = password
+        result = self._login(username, password)
+        if self.sessionFile is not None:
+            self.saveSession(self.sessionFile)
+        return result
+
+    def _login(self, username, password):
+        """ Submit the login form (see login)
+        """
         # Open the Login Page, and login
         b = self.browser
-        b.open(self.baseURL + "/Login.do") # don't use _openPath() for this
+        self._submit(self.baseURL + "/Login.do", loginPageOK=True) # don't use _openPath() for this
         if (self._isLoginPage()):
             b.select_form(nr=0)
             b.form['username'] = username
             b.form['password'] = password
-            resp = b.submit()
+            html = self._submit(loginPageOK=True)
         else:
             raise CloudSitesError("Login Page Not Detected at Login")
             return False
@@ -158,12 +1795,7 @@ class Account(CloudSitesCommon):
         elif ( b.geturl() == (self.baseURL + '/Home.do') ):
             # May just need to be an empty "else" here?
             # Ugly Part - Parse the output to see if we are logged in or not
-            html = resp.read()
-            match = re.search(r'You are logged in as: \<strong\>(?P<username>\w+?)\</strong\>,\s+(?P<accountName>.+?) \(\#(?P<rsAccountID>\d+)\)', html)
-            if match:
-                self.accountLogin = match.group(1)
-                self.accountName = match.group(2)
-                self.accountID = match.group(3)
+            if self._parseHome(html):
                 self.authenticated = True
                 return True
             else:
@@ -177,14 +1809,91 @@ class Account(CloudSitesCommon):
             return True
         return
 
+    def _parseHome(self, html):
+        """ Pick the account login, name and ID out of the /Home.do page
+            RETURN: True if they were found
+        """
+        match = re.search(r'You are logged in as: \<strong\>(?P<username>\w+?)\</strong\>,\s+(?P<accountName>.+?) \(\#(?P<rsAccountID>\d+)\)', html)
+        if match:
+            self.accountLogin = match.group(1)
+            self.accountName = match.group(2)
+            self.accountID = match.group(3)
+            return True
+        return False
+
+    # Cookie attributes stored by saveSession (the arguments of mechanize.Cookie)
+    _cookieFields = ('version', 'name', 'value', 'port', 'port_specified', 'domain',
+                     'domain_specified', 'domain_initial_dot', 'path', 'path_specified',
+                     'secure', 'expires', 'discard', 'comment', 'comment_url', 'rfc2109')
+
+    def saveSession(self, path):
+        """ Save the session cookies and account details to "path" (readable by the owner only)
+            so a later process can skip logging in (see loadSession)
+        """
+        if not self.authenticated:
+            raise CloudSitesError("Please use login('username', 'password') method first")
+        cookies = [ ]
+        for cookie in self.cookieJar:
+            fields = dict((field, getattr(cookie, field)) for field in self._cookieFields)
+            fields['rest'] = cookie._rest
+            cookies.append(fields)
+        data = {
+            'baseURL': self.baseURL,
+            'accountLogin': getattr(self, 'accountLogin', None),
+            'accountName': getattr(self, 'accountName', None),
+            'accountID': getattr(self, 'accountID', None),
+            'cookies': cookies,
+        }
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        return
+
+    def loadSession(self, path):
+        """ Restore a session saved with saveSession and check that it is still valid
+            (a single request to /Home.do)
+
+            RETURN: True if the session can be used, False if a login is needed
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return False
+        if data.get('baseURL') != self.baseURL:
+            return False
+        self.cookieJar.clear()
+        now = time.time()
+        for fields in data.get('cookies', [ ]):
+            fields = dict((str(key), value.encode('utf-8') if isinstance(value, unicode) else value)
+                          for key, value in fields.iteritems())
+            cookie = mechanize.Cookie(**fields)
+            if not cookie.is_expired(now):
+                self.cookieJar.set_cookie(cookie)
+        # Is the session still alive?
+        html = self._submit(self.baseURL + '/Home.do', loginPageOK=True)
+        if self._isLoginPage():
+            self.cookieJar.clear()
+            return False
+        if not self._parseHome(html):
+            self.accountLogin = data.get('accountLogin')
+            self.accountName = data.get('accountName')
+            self.accountID = data.get('accountID')
+        self.authenticated = True
+        # Pooled browsers need the restored cookies
+        self._session += 1
+        return True
+
     def logout(self):
         """ Logout from Cloud Sites
             Probably would only call when exiting unless we needed to change accounts
         """
-        b = self.browser
-        b.open(self.baseURL + "/Logout.do") # don't use _openPath() for this
-        # Reset all variables to the initial state (call __init__())
-        self.__init__()
+        self.disablePrefetch()
+        self._submit(self.baseURL + "/Logout.do", loginPageOK=True) # don't use _openPath() for this
+        # Reset all variables to the initial state (call __init__()), keeping the hooks
+        hooks = self.hooks
+        self.__init__(self.cache.ttl, self.cache.maxEntries, self.credentials, self.pooledTransport)
+        self.hooks = hooks
         return
 
     def getClientList(self):
@@ -193,38 +1902,606 @@ class Account(CloudSitesCommon):
         # Ensure we are authenticated
         if not self.authenticated:
             raise CloudSitesError("Please use login('username', 'password') method first")
-        self._openPath('/ClientList.do')
-        data = self._parseForJsVarPart('tableData0')
-        # data['rows'] - list of clients
-        # There is other information in tableData0, but all we want is the client rows for now
-        for client in iter(data['rows']):
+        # rows of tableData0 (every page of it) - list of clients
+        rows, = self._listRows('/ClientList.do')
+        for client in rows:
             # client[2] is client ID
             # client[3] is a list containing ['Client Name', 'url']
             clientID = client[2]
             name = client[3][0]
             url = client[3][1]
+            if clientID in self.clientList:
+                self._unindex(self.clientList[clientID])
             self.clientList[clientID] = Client(self,clientID,name,url)
+            self.clientList[clientID].rowHash = _rowHash(client)
+        return self.clientList.keys()
+
+    def displayClients(self):
+        """ Display a Simple List of clients (for testing)
+        """
+        if not self.clientList:
+            self.getClientList()
+        for client in self.clientList.itervalues():
+            # client[0] is client ID
+            # client[1] is a Client object
+            print 'ClientID: ' + client.clientID
+            print 'Client Name: ' + client.name
+            print 'URL: ' + self.baseURL + client.url
+            print
+        return
+
+    def getClient(self,clientID):
+        """ Obtain a specific client object with the clientID
+        """
+        clientID = str(clientID)
+        return self.clientList.get(clientID)
+
+    def _canRelogin(self):
+        """ True if we know how to login again
+        """
+        return self._username is not None or self.credentials is not None
+
+    def _relogin(self, session):
+        """ Login again after "session" timed out
+            (if another thread already did it for that session, there is nothing to do)
+        """
+        with self._reloginLock:
+            if self._session != session:
+                return
+            started = time.time()
+            if self.credentials is not None:
+                self.login()
+            else:
+                self.login(self._username, self._password)
+            self._session += 1
+            self._emit('relogin', seconds=time.time() - started)
+        return
+
+    def _copyCookies(self):
+        """ A new cookie jar holding a copy of the logged in session's cookies
+        """
+        jar = mechanize.CookieJar()
+        for cookie in self.cookieJar:
+            jar.set_cookie(copy.copy(cookie))
+        return jar
+
+    def _syncBrowser(self, browser):
+        """ Give a pooled browser the current session's cookies (if it does not have them yet)
+        """
+        if browser is self.browser:
+            return
+        session = self._session
+        if self._browserSessions.get(id(browser)) != session:
+            browser.set_cookiejar(self._copyCookies())
+            self._browserSessions[id(browser)] = session
+        return
+
+    def addHook(self, hook):
+        """ Call hook(event, data) for every instrumentation event, e.g. a Stats collector:
+                - request: url, pageType, bytes, seconds, openSeconds (network), readSeconds
+                  (page loads, form submits and logins; url is the form's action for submits)
+                - cacheHit: url, pageType, bytes
+                - parse: varName ('(scan)', 'tableDataN', 'databaseDetail', ...), seconds, bytes
+                - relogin: seconds
+                - schedulerWait: seconds spent waiting for the Scheduler
+                - bulk: action, database, status, seconds (every bulkDatabaseUsers job)
+        """
+        self.hooks.append(hook)
+        return
+
+    def _loaded(self, obj):
+        """ Note that obj just loaded its children, unloading the least recently loaded
+            objects if there are more than childBudget of them
+        """
+        if self.childBudget is None:
+            return
+        with self._loadedLock:
+            self._loadedObjects.pop(id(obj), None)
+            self._loadedObjects[id(obj)] = obj
+            while len(self._loadedObjects) > self.childBudget:
+                self._loadedObjects.popitem(last=False)[1].unload()
+        return
+
+    def _index(self, kind, owner, entries):
+        """ Replace what owner put in one of the lookup indexes
+                ARGS:
+                    - kind - 'domain' (Client: domain -> Website), 'ftpUser' (Client: username -> Client)
+                      or 'databaseUser' (Database: username -> Database)
+                    - owner - object the entries come from
+                    - entries - dict key -> object ({ } to remove owner's entries)
+        """
+        with self._indexLock:
+            index = self._indexes[kind]
+            for key in self._indexedKeys.pop((kind, id(owner)), ()):
+                entry = index.get(key)
+                if entry is not None and entry[0] == id(owner):
+                    del index[key]
+                    if kind == 'domain':
+                        for suffix in _domainSuffixes(key):
+                            websites = self._domainSuffixIndex.get(suffix)
+                            websites.pop(id(entry[1]), None)
+                            if not websites:
+                                del self._domainSuffixIndex[suffix]
+            for key, obj in entries.items():
+                index[key] = (id(owner), obj)
+                if kind == 'domain':
+                    for suffix in _domainSuffixes(key):
+                        self._domainSuffixIndex.setdefault(suffix, { })[id(obj)] = obj
+            if entries:
+                self._indexedKeys[(kind, id(owner))] = entries.keys()
+        return
+
+    def _indexLoaded(self, obj):
+        """ Put what obj (Client or Database) has loaded in the lookup indexes
+        """
+        if isinstance(obj, Client):
+            if obj._websites is not None:
+                self._index('domain', obj, dict((_domainKey(website.domainName), website)
+                                                for website in obj._websites.itervalues()))
+            if obj._users is not None:
+                self._index('ftpUser', obj, dict.fromkeys(obj._users, obj))
+        elif isinstance(obj, Database) and obj._users is not None:
+            self._index('databaseUser', obj, dict.fromkeys(obj._users, obj))
+        return
+
+    def _unindex(self, obj):
+        """ Take obj and its loaded children out of the lookup indexes
+        """
+        for kind in self._indexes:
+            self._index(kind, obj, { })
+        for child in obj._children():
+            self._unindex(child)
+        return
+
+    def _reindex(self):
+        """ Rebuild the lookup indexes from the loaded objects (e.g. after loading a snapshot)
+        """
+        with self._indexLock:
+            for index in self._indexes.values():
+                index.clear()
+            self._domainSuffixIndex.clear()
+            self._indexedKeys.clear()
+        for client in self.clientList.values():
+            self._indexLoaded(client)
+            for website in client._children():
+                for database in (website._databaseList or { }).itervalues():
+                    self._indexLoaded(database)
+        return
+
+    def findWebsite(self, domain):
+        """ Website serving domain (case insensitive, with or without "www."), from the
+            loaded websites - no requests are made
+
+            RETURN: Website object (or None)
+        """
+        key = _domainKey(domain)
+        index = self._indexes['domain']
+        entry = index.get(key)
+        if entry is None:
+            entry = index.get(key[4:] if key.startswith('www.') else 'www.' + key)
+        return entry[1] if entry is not None else None
+
+    def findWebsites(self, domain):
+        """ Loaded websites for domain and all its subdomains (e.g. example.com finds
+            example.com, www.example.com and shop.example.com) - no requests are made
+
+            RETURN: list of Website objects (sorted by domain name)
+        """
+        websites = self._domainSuffixIndex.get(_domainKey(domain), { }).values()
+        return sorted(websites, key=lambda website: _domainKey(website.domainName))
+
+    def findFtpUser(self, username):
+        """ Client an (S)FTP user belongs to, from the loaded users - no requests are made
+
+            RETURN: Client object (or None)
+        """
+        entry = self._indexes['ftpUser'].get(username)
+        return entry[1] if entry is not None else None
+
+    def findDatabaseUser(self, username):
+        """ Database a database user belongs to, from the loaded users - no requests are made
+
+            RETURN: Database object (or None)
+        """
+        entry = self._indexes['databaseUser'].get(username)
+        return entry[1] if entry is not None else None
+
+    @property
+    def browser(self):
+        """ The account's shared mechanize.Browser (created, importing mechanize, on first use)
+        """
+        if self._browser is None:
+            with self._browserLock:
+                if self._browser is None:
+                    cookieJar = mechanize.CookieJar()
+                    browser = self._newBrowser()
+                    browser.set_cookiejar(cookieJar)
+                    self._cookieJar = cookieJar
+                    self._browser = browser
+        return self._browser
+
+    @browser.setter
+    def browser(self, browser):
+        self._browser = browser
+
+    @property
+    def cookieJar(self):
+        """ Cookie jar of the account's shared browser (the logged in session)
+        """
+        if self._cookieJar is None:
+            self.browser
+        return self._cookieJar
+
+    def _newBrowser(self):
+        """ Create a browser (using the pooled transport if asked for)
+        """
+        if self.pooledTransport:
+            return _pooledBrowserClass()(history=_NoHistory())
+        return mechanize.Browser(history=_NoHistory())
+
+    def _cloneBrowser(self):
+        """ Create a new browser carrying a copy of the logged in session's cookies
+        """
+        browser = self._newBrowser()
+        self._syncBrowser(browser)
+        return browser
+
+    def enablePrefetch(self, workers=4, maxPending=1000):
+        """ Read ahead: as soon as getWebsiteList / getFeatures have parsed the children, fetch
+            their pages (website features, database details) into the page cache in the
+            background, so walking the objects one by one does not wait on the network
+            (the cache must be big enough to hold what is read ahead, see cacheSize)
+                ARGS:
+                    - workers - number of background fetches at a time
+                    - maxPending - most pages queued for reading ahead
+
+            RETURN: the Prefetcher (fetched/dropped/errors counters)
+        """
+        if self.cache is None or self.cache.maxEntries < 1:
+            raise CloudSitesError("Prefetching needs the page cache (cacheSize > 0)")
+        self.disablePrefetch()
+        self.prefetcher = Prefetcher(self, workers, maxPending)
+        return self.prefetcher
+
+    def disablePrefetch(self):
+        """ Stop reading ahead (pages already cached stay there)
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        return
+
+    def _prefetch(self, paths):
+        """ Queue pages for reading ahead (if enabled)
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.add(paths)
+        return
+
+    def _openPages(self, paths):
+        """ Open several pages concurrently (pageWorkers), each with a browser from the pool
+
+            RETURN: list of _ListingPage (in the same order as paths)
+        """
+        # The pages are fetched with the Scheduler priority of the calling thread
+        priority = getattr(_requestContext, 'priority', None)
+
+        def fetch(path):
+            _requestContext.priority = priority
+            try:
+                browser = self._idleBrowsers.get_nowait()
+            except Queue.Empty:
+                browser = self._cloneBrowser()
+            self._syncBrowser(browser)
+            page = _ListingPage(self, browser)
+            try:
+                page._openPath(path)
+            finally:
+                self._idleBrowsers.put(browser)
+            return page
+        return _runParallel(fetch, paths, self.pageWorkers)
+
+    def _runBulk(self, obj, method, *args):
+        """ _runWithBrowser for bulk (crawl) traffic: the Scheduler lets interactive requests go first
+        """
+        previous = getattr(_requestContext, 'priority', None)
+        _requestContext.priority = Scheduler.BULK
+        try:
+            return self._runWithBrowser(obj, method, *args)
+        finally:
+            _requestContext.priority = previous
+
+    def _runWithBrowser(self, obj, method, *args):
+        """ Call obj.method(*args) using a browser from the pool instead of the shared one
+                ARGS:
+                    - obj - Client, Website or Database object
+                    - method - name of the method to call
+        """
+        try:
+            browser = self._idleBrowsers.get_nowait()
+        except Queue.Empty:
+            browser = self._cloneBrowser()
+        self._syncBrowser(browser)
+        obj.browser = browser
+        try:
+            return getattr(obj, method)(*args)
+        finally:
+            # Back to the shared browser (children created during the call use it already)
+            obj.browser = None
+            self._idleBrowsers.put(browser)
+
+    def crawl(self, workers=4, cronJobs=False, clientIDs=None):
+        """ Crawl the whole account (clients, websites, FTP users, databases) using "workers"
+            concurrent browser sessions cloned from the logged in one.
+            With cronJobs the detail page of every cron job is fetched as well, with clientIDs
+            only those clients are crawled.
+
+            RETURN: self.clientList, the same object graph the sequential get* calls build
+        """
+        # Ensure we are authenticated
+        if not self.authenticated:
+            raise CloudSitesError("Please use login('username', 'password') method first")
+        self.getClientList()
+        if clientIDs is None:
+            clients = self.clientList.values()
+        else:
+            clients = [self.clientList[str(clientID)] for clientID in clientIDs
+                       if str(clientID) in self.clientList]
+        _runParallel(lambda client: self._runBulk(client, 'getWebsiteList'), clients, workers)
+        _runParallel(lambda client: self._runBulk(client, 'getUserList'), clients, workers)
+        websites = [website for client in clients for website in client.websites.itervalues()]
+        _runParallel(lambda website: self._runBulk(website, 'getFeatures'), websites, workers)
+        databases = [db for website in websites for db in website.databaseList.itervalues()]
+        _runParallel(lambda db: self._runBulk(db, 'getDetail'), databases, workers)
+        if cronJobs:
+            jobs = [job for website in websites for job in website.cronJobs.itervalues()]
+            _runParallel(lambda job: self._runBulk(job, 'getDetail'), jobs, workers)
+        return self.clientList
+
+    def iterClients(self):
+        """ Yield every Client of the account
+        """
+        self.getClientList()
+        for client in self.clientList.values():
+            yield client
+
+    def iterWebsites(self, workers=1):
+        """ Yield every Website of the account as soon as its client's website list is parsed
+                ARGS:
+                    - workers - number of concurrent browser sessions
+        """
+        fetch = lambda client: (self._runBulk(client, 'getWebsiteList'), client)[1]
+        for client in _iterParallel(fetch, self.iterClients(), workers):
+            for website in client.websites.values():
+                yield website
+
+    def iterDatabases(self, workers=1, detail=True):
+        """ Yield every Database of the account as soon as it is parsed
+                ARGS:
+                    - workers - number of concurrent browser sessions
+                    - detail - also get the database details (and users) before yielding it
+        """
+        fetch = lambda website: (self._runBulk(website, 'getFeatures'), website)[1]
+        websites = _iterParallel(fetch, self.iterWebsites(workers), workers)
+        databases = (db for website in websites for db in website.databaseList.values())
+        if not detail:
+            for db in databases:
+                yield db
+            return
+        fetch = lambda db: (self._runBulk(db, 'getDetail'), db)[1]
+        for db in _iterParallel(fetch, databases, workers):
+            yield db
+
+    def iterCronJobs(self, workers=1, detail=True):
+        """ Yield every CronJob of the account as soon as it is parsed
+                ARGS:
+                    - workers - number of concurrent browser sessions
+                    - detail - also get the job details (schedule, command, ...) before yielding it
+        """
+        fetch = lambda website: (self._runBulk(website, 'getFeatures'), website)[1]
+        websites = _iterParallel(fetch, self.iterWebsites(workers), workers)
+        jobs = (job for website in websites for job in website.cronJobs.values())
+        if not detail:
+            for job in jobs:
+                yield job
+            return
+        fetch = lambda job: (self._runBulk(job, 'getDetail'), job)[1]
+        for job in _iterParallel(fetch, jobs, workers):
+            yield job
+
+    def diff(self, old):
+        """ Changes since an earlier crawl (Account object or snapshot file), see diffAccounts
+        """
+        return diffAccounts(old, self)
+
+    def saveSnapshot(self, path):
+        """ Save the loaded clients, websites, databases (with their users), cron jobs and
+            FTP users to a SQLite file (see Snapshot)
+        """
+        snapshot = Snapshot(path)
+        try:
+            snapshot.store(self)
+        finally:
+            snapshot.close()
+        return
+
+    def loadSnapshot(self, path):
+        """ Load clients, websites, databases, cron jobs and FTP users from a SQLite file
+            written by saveSnapshot (no requests are made)
+
+            RETURN: list of clientIDs
+        """
+        snapshot = Snapshot(path)
+        try:
+            snapshot.load(self)
+        finally:
+            snapshot.close()
+        self._reindex()
         return self.clientList.keys()
 
-    def displayClients(self):
-        """ Display a Simple List of clients (for testing)
+    def refreshSnapshot(self, path, workers=4, checkWebsites=True):
+        """ Bring a SQLite snapshot up to date, fetching only what changed
+                - clients whose ClientList.do row changed get their FTP users (and websites) re-fetched
+                - websites whose ClientWebsiteList.do row changed (or are new) get their features
+                  and database details re-fetched
+                ARGS:
+                    - path - SQLite file (created with a full crawl if it does not exist)
+                    - workers - number of concurrent browser sessions
+                    - checkWebsites - also look at the website list of unchanged clients
+
+            RETURN: self.clientList
         """
-        if not self.clientList:
-            self.getClientList()
-        for client in self.clientList.itervalues():
-            # client[0] is client ID
-            # client[1] is a Client object
-            print 'ClientID: ' + client.clientID
-            print 'Client Name: ' + client.name
-            print 'URL: ' + self.baseURL + client.url
-            print
-        return
+        # Ensure we are authenticated
+        if not self.authenticated:
+            raise CloudSitesError("Please use login('username', 'password') method first")
+        # The lists have to come from Cloud Sites, not from the page cache
+        self.cache.clear()
+        self.clientList = { }
+        self.loadSnapshot(path)
+        previous = self.clientList
+        self.clientList = { }
+        self.getClientList()
+        clients = [ ]
+        for clientID, client in self.clientList.items():
+            old = previous.get(clientID)
+            if old is not None and old.rowHash == client.rowHash:
+                if not checkWebsites:
+                    # Keep the whole subtree from the snapshot
+                    self.clientList[clientID] = old
+                    continue
+                client.users = old._users
+            else:
+                old = None
+            clients.append((client, old))
+        _runParallel(lambda client: self._runBulk(client, 'getWebsiteList'),
+                     [client for client, old in clients], workers)
+        _runParallel(lambda client: self._runBulk(client, 'getUserList'),
+                     [client for client, old in clients if old is None or old._users is None], workers)
+        websites = [ ]
+        for client, old in clients:
+            oldClient = previous.get(client.clientID)
+            for websiteID, website in client.websites.items():
+                oldWebsite = (oldClient._websites or { }).get(websiteID) if oldClient is not None else None
+                if oldWebsite is not None and oldWebsite.rowHash == website.rowHash:
+                    # Unchanged, keep the website (and its databases) from the snapshot
+                    oldWebsite.client = client
+                    client.websites[websiteID] = oldWebsite
+                else:
+                    websites.append(website)
+        _runParallel(lambda website: self._runBulk(website, 'getFeatures'), websites, workers)
+        databases = [db for website in websites for db in website.databaseList.itervalues()]
+        _runParallel(lambda db: self._runBulk(db, 'getDetail'), databases, workers)
+        # Websites carried over from the snapshot replaced the fetched ones
+        self._reindex()
+        self.saveSnapshot(path)
+        return self.clientList
+
+    def bulkDatabaseUsers(self, jobs, workers=4, journal=None):
+        """ Create database users / change their passwords across many databases at once
+            The jobs of a database run one after the other, up to "workers" databases at a time
+            (bulk Scheduler priority), sharing the database page loads (see planDatabaseUsers).
+            With a journal, every finished job is written down as it completes; running the same
+            jobs again with that journal skips the ones done.
+                ARGS:
+                    - jobs - list of (database, username, password) to change a password, or
+                      (database, username, password, 'createUser') to create a user
+                      (database is a Database object or the name of a loaded one)
+                    - workers - number of databases worked on concurrently
+                    - journal - path of the progress journal (JSON lines, no passwords; None = none)
+
+            RETURN: list of result dicts (in the order of jobs):
+                    action, database, username, status ('done', 'skipped' or 'failed'), error, seconds
+        """
+        journal = _BulkJournal(journal) if journal is not None else None
+        results = [None] * len(jobs)
+        byDatabase = OrderedDict()
+        for index, (database, username, password, action) in enumerate(self._parseUserJobs(jobs)):
+            result = {'action': action, 'database': getattr(database, 'name', database),
+                      'username': username, 'status': 'skipped', 'error': None, 'seconds': 0.0}
+            results[index] = result
+            if journal is not None and journal.isDone(result):
+                continue
+            if not isinstance(database, Database):
+                result['status'] = 'failed'
+                result['error'] = "Database " + database + " not found"
+                continue
+            byDatabase.setdefault(id(database), (database, [ ]))[1].append((result, password))
+
+        def run(item):
+            database, work = item
+
+            def done(index, error, seconds):
+                result = work[index][0]
+                if error is None:
+                    result['status'] = 'done'
+                else:
+                    result['status'] = 'failed'
+                    result['error'] = str(error.value if isinstance(error, CloudSitesError) else error)
+                result['seconds'] = seconds
+                self._emit('bulk', action=result['action'], database=result['database'],
+                           status=result['status'], seconds=result['seconds'])
+                if journal is not None:
+                    journal.record(result)
+                return
+
+            self._runBulk(database, '_applyUserJobs',
+                          [(result['action'], result['username'], password) for result, password in work], done)
+            return
+
+        try:
+            _runParallel(run, byDatabase.values(), workers)
+        finally:
+            if journal is not None:
+                journal.close()
+        return results
+
+    def planDatabaseUsers(self, jobs, workers=4, snapshot=None, secondsPerRequest=None):
+        """ Dry run of bulkDatabaseUsers: resolve the databases and work out the requests it
+            would make, without making any
+                ARGS:
+                    - jobs - as for bulkDatabaseUsers
+                    - workers - number of databases worked on concurrently
+                    - snapshot - SQLite file to load first (loadSnapshot), for planning without
+                      having crawled the account
+                    - secondsPerRequest - estimated seconds per request (default: the mean
+                      request time collected by a Stats hook, else BulkPlan.secondsPerRequest)
+
+            RETURN: BulkPlan object (plan.run() carries it out)
+        """
+        if snapshot is not None:
+            self.loadSnapshot(snapshot)
+        return BulkPlan(self, jobs, workers, secondsPerRequest)
 
-    def getClient(self,clientID):
-        """ Obtain a specific client object with the clientID
+    def _parseUserJobs(self, jobs):
+        """ Check the jobs of bulkDatabaseUsers / planDatabaseUsers and resolve the database
+            names among the loaded databases (no requests are made)
+
+            RETURN: list of (database, username, password, action); database is a Database
+                    object, or its name if no loaded database has that name
         """
-        clientID = str(clientID)
-        return self.clientList.get(clientID)
+        parsed = [ ]
+        databases = None
+        for job in jobs:
+            database, username, password = job[:3]
+            action = job[3] if len(job) > 3 else 'changePassword'
+            if action not in ('changePassword', 'createUser'):
+                raise CloudSitesError("Unknown database user action: " + str(action))
+            if not isinstance(database, Database):
+                if databases is None:
+                    databases = self._loadedDatabases()
+                database = databases.get(str(database), str(database))
+            parsed.append((database, str(username), password, action))
+        return parsed
+
+    def _loadedDatabases(self):
+        """ RETURN: dict name -> Database of the loaded databases (no requests are made)
+        """
+        databases = { }
+        for client in self.clientList.values():
+            for website in client._children():
+                for database in (website._databaseList or { }).itervalues():
+                    databases[database.name] = database
+        return databases
 
 
 
@@ -232,7 +2509,10 @@ class Account(CloudSitesCommon):
 class Client(CloudSitesCommon):
     """ Rackspace Cloud Sites Client
             This object belongs to an Account object
+            websites and users are loaded on first access (see getWebsiteList/getUserList)
     """
+    __slots__ = ('account', 'clientID', 'name', 'url', '_websites', '_users', 'rowHash',
+                 '_browser', 'cache', '_html', '_jsMemoData')
 
     def __init__(self, account, clientID, name, url):
         """ INIT for Client object
@@ -246,23 +2526,72 @@ class Client(CloudSitesCommon):
         self.clientID = str(clientID)
         self.name = str(name)
         self.url = str(url)
-        self.websites = { }
-        self.users = {}
-        self.browser = account.browser
+        self._websites = None
+        self._users = None
+        self.rowHash = None
+        self._browser = None
+        self.cache = account.cache
+        self._html = None
+        self._jsMemoData = None
+        return
+
+    @property
+    def websites(self):
+        """ websiteID -> Website (loaded on first access)
+        """
+        if self._websites is None:
+            self.getWebsiteList()
+        return self._websites
+
+    @websites.setter
+    def websites(self, websites):
+        self._websites = websites
+
+    @property
+    def users(self):
+        """ (S)FTP userName -> (userID, name, accessLevel) (loaded on first access)
+        """
+        if self._users is None:
+            self.getUserList()
+        return self._users
+
+    @users.setter
+    def users(self, users):
+        self._users = users
+
+    def _children(self):
+        """ Loaded child objects (without loading anything)
+        """
+        return (self._websites or { }).values()
+
+    def toDict(self):
+        """ Plain dict describing this client (for JSON output)
+        """
+        return {'type': 'client', 'clientID': self.clientID, 'name': self.name, 'url': self.url}
+
+    def unload(self):
+        """ Drop the loaded websites and users (they are loaded again when needed)
+            (they leave the account's lookup indexes as well)
+        """
+        self.account._unindex(self)
+        self._websites = None
+        self._users = None
+        self._html = None
+        self._jsMemoData = None
         return
-    
+
     def getWebsiteList(self):
         """ Get the websites configured for this client
         """
 
         url = self.url.replace('/ClientSettings.do', '/ClientWebsiteList.do', 1)
-        self._openPath(url)
         # maybe it would be better to find/click a link rather than constructing a URL?
         #self._openPath('/ClientWebsiteList.do?accountID=' + self.clientID + '&pageTitle=ClientName')
-        data = self._parseForJsVarPart('tableData0')
-        # data['rows'] - list of clients
-        # There is other information in tableData0, but all we want is the client rows for now
-        for website in iter(data['rows']):
+        # rows of tableData0 (every page of it) - list of websites
+        rows, = self._listRows(url)
+        if self._websites is None:
+            self._websites = { }
+        for website in rows:
             # website[0] is a list containing ['WebsiteID', '', '']
             # website[1] is "Full"
             # website[2] is a list containing ['domainName', 'url']
@@ -271,15 +2600,20 @@ class Client(CloudSitesCommon):
             domainName = website[2][0]
             url = website[2][1]
             name = website[3]
-            self.websites[websiteID] = Website(self, websiteID, name, url, domainName)
-        return self.websites.keys()
+            if websiteID in self._websites:
+                self.account._unindex(self._websites[websiteID])
+            self._websites[websiteID] = Website(self, websiteID, name, url, domainName)
+            self._websites[websiteID].rowHash = _rowHash(website)
+        self.account._indexLoaded(self)
+        self.account._prefetch([self._listPath(website._featuresPath())
+                                for website in self._websites.itervalues()])
+        self.account._loaded(self)
+        return self._websites.keys()
 
     def displayWebsites(self):
         """ Display a Simple List of websites for a specific client (for testing)
         """
 
-        if not self.websites: # Attempt to get it
-            self.getWebsiteList()
         for website in self.websites.itervalues():
             # website - Website object
             print 'WebsiteID: ' + website.websiteID
@@ -300,11 +2634,11 @@ class Client(CloudSitesCommon):
         """
 
         url = self.url.replace('/ClientSettings.do', '/FTPSettings.do', 1)
-        self._openPath(url)
-        data = self._parseForJsVarPart('tableData0')
-        # data['rows'] - list of users
-        # There is other information in tableData0, but all we want is the client rows for now
-        for user in iter(data['rows']):
+        # rows of tableData0 (every page of it) - list of users
+        rows, = self._listRows(url)
+        if self._users is None:
+            self._users = { }
+        for user in rows:
             # user[0] is a list containing ['UserID', '', 'disabled']
             # user[1] is "username"
             # user[2] is "Full Name" (Primary User)
@@ -314,8 +2648,10 @@ class Client(CloudSitesCommon):
             userName = user[1]
             name = user[2]
             accessLevel = user[4]
-            self.users[userName] = (userID, name, accessLevel)
-        return self.users.keys()
+            self._users[userName] = (userID, name, accessLevel)
+        self.account._indexLoaded(self)
+        self.account._loaded(self)
+        return self._users.keys()
 
     def createUser(username, password):
         """ Create a database user for this database
@@ -337,16 +2673,17 @@ class Client(CloudSitesCommon):
         # We could do validation of the username/password, but it would be better to just let rackspace fail it for now
 
         url = self.url.replace('/ClientSettings.do', '/FTPSettings.do', 1)
-        self._openPath(url)
+        self._openPath(url, force=True)
+        self._invalidate(url)
         b = self.browser
         b.select_form(name='addNewUserForm')
-        b.submit()
+        self._submit()
         b.select_form(name='SaveNewUserForm')
         b.form['username'] = username
         b.form['password'] = password
         b.form['passwordConfirm'] = password
         # Not sure how to fill out the "access level, hopefully it defaults to something useful
-        b.submit()
+        self._submit()
         ### BROKE! There is a captcha here, burned!
 
         
@@ -359,7 +2696,10 @@ class Client(CloudSitesCommon):
 class Website(CloudSitesCommon):
     """ Rackspace Cloud Sites Website
             This object belongs to a Client object
+            databaseList, cronJobs and cronList are loaded on first access (see getFeatures)
     """
+    __slots__ = ('client', 'clientID', 'websiteID', 'name', 'url', 'domainName', '_databaseList',
+                 '_cronList', '_cronJobs', 'rowHash', '_browser', 'cache', 'account', '_html', '_jsMemoData')
 
     def __init__(self, client, websiteID, name, url, domainName):
         """ INIT for Client object
@@ -376,28 +2716,106 @@ class Website(CloudSitesCommon):
         self.name = str(name)
         self.url = str(url)
         self.domainName = str(domainName)
-        self.databaseList = { }
-        self.cronList = None
-        self.browser = client.browser
+        self._databaseList = None
+        self._cronList = None
+        self._cronJobs = None
+        self.rowHash = None
+        self._browser = None
+        self.cache = client.cache
+        self.account = client.account
+        self._html = None
+        self._jsMemoData = None
+        return
+
+    @property
+    def databaseList(self):
+        """ database name -> Database (loaded on first access)
+        """
+        if self._databaseList is None:
+            self.getFeatures()
+        return self._databaseList
+
+    @databaseList.setter
+    def databaseList(self, databaseList):
+        self._databaseList = databaseList
+
+    @property
+    def cronList(self):
+        """ cron job rows as listed on the features page (loaded on first access)
+        """
+        if self._cronList is None:
+            self.getFeatures()
+        return self._cronList
+
+    @cronList.setter
+    def cronList(self, cronList):
+        self._cronList = cronList
+        if cronList is None:
+            self._cronJobs = None
+            return
+        self._cronJobs = OrderedDict()
+        for job in cronList:
+            # job[0] is a list ['jobID', '', '']
+            # job[1] is a number (index?)
+            # job[2] is a list containing ['jobName', 'url']
+            cronJob = CronJob(self, job[0][0], job[2][0], job[2][1])
+            cronJob.rowHash = _rowHash(job)
+            # By jobID: several jobs may have the same name
+            self._cronJobs[cronJob.jobID] = cronJob
+
+    @property
+    def cronJobs(self):
+        """ cron jobID -> CronJob (loaded on first access)
+        """
+        if self._cronJobs is None:
+            self.getFeatures()
+        return self._cronJobs
+
+    def _children(self):
+        """ Loaded child objects (without loading anything)
+        """
+        return (self._databaseList or { }).values() + (self._cronJobs or { }).values()
+
+    def toDict(self):
+        """ Plain dict describing this website (for JSON output)
+        """
+        return {'type': 'website', 'clientID': self.clientID, 'websiteID': self.websiteID,
+                'name': self.name, 'url': self.url, 'domainName': self.domainName}
+
+    def unload(self):
+        """ Drop the loaded databases and cron jobs (they are loaded again when needed)
+            (they leave the account's lookup indexes as well)
+        """
+        self.account._unindex(self)
+        self._databaseList = None
+        self._cronList = None
+        self._cronJobs = None
+        self._html = None
+        self._jsMemoData = None
         return
 
+    def _featuresPath(self):
+        """ Path of the features page of this website
+        """
+        return self.url.replace('/WebsiteSettings.do', '/WebsiteFeatures.do', 1)
+
     def getFeatures(self):
         """ Get the Features configured on this website
             Features Include: databases, cronJobs, etc
         """
 
-        url = self.url.replace('/WebsiteSettings.do', '/WebsiteFeatures.do', 1)
-        self._openPath(url)
+        url = self._featuresPath()
         # maybe it would be better to find/click a link rather than constructing a URL?
         #self._openPath('/WebsiteFeatures.do?accountID=' + self.clientID + '&siteID=' + self.websiteID+ '&pageTitle=websiteName')
         ##DOESNT WORK##
         #data = self._parseForJsVar('listTableArgs')
         # data['tableData0'] -> databases
         # data['tableData1'] -> cron jobs
-        #### Fall back to parsing for individual parts
-        databases = self._parseForJsVarPart('tableData0')['rows']
-        cronList = self._parseForJsVarPart('tableData1')['rows']
+        #### Fall back to parsing for individual parts (every page of them)
+        databases, cronList = self._listRows(url, ('tableData0', 'tableData1'))
 
+        if self._databaseList is None:
+            self._databaseList = { }
         for db in databases:
             # db[0] is a (checkbox)
             # db[1] is a number (index?)
@@ -406,18 +2824,20 @@ class Website(CloudSitesCommon):
             name = db[2][0]
             dbType = db[3]
             url = db[2][1]
-            self.databaseList[name] = Database(self, name, dbType, url)
+            if name in self._databaseList:
+                self.account._unindex(self._databaseList[name])
+            self._databaseList[name] = Database(self, name, dbType, url)
 
         self.cronList = cronList
+        self.account._prefetch([db.url for db in self._databaseList.itervalues()])
+        self.account._loaded(self)
 
-        return (self.databaseList.keys(), cronList)
+        return (self._databaseList.keys(), cronList)
 
     def displayDatabases(self):
         """ Display a Simple List of Databases for a specific website (for testing)
         """
 
-        if not self.databaseList: # Attempt to get it
-            self.getFeatures()
         for db in self.databaseList.itervalues():
             # db[0] is a (checkbox)
             # db[1] is a number (index?)
@@ -438,24 +2858,35 @@ class Website(CloudSitesCommon):
     def displayCronJobs(self):
         """ Display a Simple List of cron jobs for a specific client (for testing)
         """
-        
-        if not self.cronList: # Attempt to get it
-            self.getFeatures()
-        for job in iter(self.cronList):
-            # job[0] is a list ['jobName', '', '']
-            # job[1] is a number (index?)
-            # job[2] is a list containing ['jobName', 'url']
-            # job[3] is type (MySQL 5)
-            print 'CronJob Name: ' + job[2][0]
-            print 'URL: ' + self.baseURL + job[2][1]
+
+        for job in self.cronJobs.itervalues():
+            # job - CronJob object
+            print 'CronJob Name: ' + job.name
+            print 'URL: ' + self.baseURL + job.url
             print
         return
 
+    def getCronJob(self, jobID):
+        """ Obtain a specific CronJob object with the jobID
+            (or else the first one named jobID)
+        """
+        jobID = str(jobID)
+        job = self.cronJobs.get(jobID)
+        if job is None:
+            for job in self.cronJobs.itervalues():
+                if job.name == jobID:
+                    return job
+            return None
+        return job
+
 ########## Database ##########
 class Database(CloudSitesCommon):
     """ Rackspace Cloud Sites Website
             This object belongs to a Website object
+            detail and users are loaded on first access (see getDetail)
     """
+    __slots__ = ('website', 'websiteID', 'name', 'dbType', 'url', '_detail', '_users',
+                 '_browser', 'cache', 'account', '_html', '_jsMemoData')
 
     def __init__(self, website, name, dbType, url):
         """ INIT for Client object
@@ -470,31 +2901,94 @@ class Database(CloudSitesCommon):
         self.name = str(name)
         self.dbType = str(dbType)
         self.url = str(url)
-        self.detail = { }
-        self.users = { }
-        self.browser = website.browser
+        self._detail = None
+        self._users = None
+        self._browser = None
+        self.cache = website.cache
+        self.account = website.account
+        self._html = None
+        self._jsMemoData = None
+        return
+
+    @property
+    def detail(self):
+        """ itemName -> value (loaded on first access)
+        """
+        if self._detail is None:
+            self.getDetail()
+        return self._detail
+
+    @detail.setter
+    def detail(self, detail):
+        self._detail = detail
+
+    @property
+    def users(self):
+        """ database userName -> url (loaded on first access)
+        """
+        if self._users is None:
+            self.getDetail()
+        return self._users
+
+    @users.setter
+    def users(self, users):
+        self._users = users
+
+    def _children(self):
+        return [ ]
+
+    def toDict(self):
+        """ Plain dict describing this database (for JSON output; detail/users only if loaded)
+        """
+        return {'type': 'database', 'clientID': self.website.clientID, 'websiteID': self.websiteID,
+                'name': self.name, 'dbType': self.dbType, 'url': self.url,
+                'detail': self._detail, 'users': self._users}
+
+    def unload(self):
+        """ Drop the loaded detail and users (they are loaded again when needed)
+            (they leave the account's lookup indexes as well)
+        """
+        self.account._unindex(self)
+        self._detail = None
+        self._users = None
+        self._html = None
+        self._jsMemoData = None
         return
-    
+
     def getDetail(self):
         """ Get the database details including server, users, etc
         """
 
         self._openPath(self.url)
-        self._parseDatabaseDetail(self.browser.response().read())
-        return self.detail
+        self._parseDatabaseDetail(self._html)
+        self.account._loaded(self)
+        return self._detail
 
     def _parseDatabaseDetail(self, html):
         """ Parse the database detail out of the html and store in self.detail
         """
-        # Things are about to get *ugly*
-        matches = re.findall(r'<td class="itemName".*?>\s*(?P<itemName>[\w\s]*?)\s*</td>' +
-	  r'.*?<td class="item".*?>\s*(?P<itemValue>.*?)\s*<[^a]', html, re.MULTILINE|re.DOTALL)
-        if matches:
-            for itemName, itemValue in matches:
-                if (itemValue.find('href=')>=0):
-                    # Pull href value out of link code
-                    itemValue = re.search(r'href="(?P<url>.*?)"', itemValue).group(1)
-                self.detail[itemName]=itemValue
+        try:
+            self._parseDatabasePage(html)
+        finally:
+            self._dropPage()
+        self.account._indexLoaded(self)
+        return
+
+    def _parseDatabasePage(self, html):
+        """ Detail items and users of a database page (see _parseDatabaseDetail)
+        """
+        started = time.time()
+        parser = _DatabaseDetailParser()
+        parser.feed(html)
+        parser.close()
+        self._emit('parse', varName='databaseDetail', seconds=time.time() - started, bytes=len(html))
+        if self._detail is None:
+            self._detail = { }
+        if self._users is None:
+            self._users = { }
+        if parser.items:
+            for itemName, itemValue in parser.items:
+                self._detail[itemName]=itemValue
         else:
             raise CloudSitesError("Error Parsing Database Details")
         userData = self._parseForJsVarPart('tableData0')['rows']
@@ -504,15 +2998,13 @@ class Database(CloudSitesCommon):
             # user[2] is a list containing ['userName', 'url']
             userName = user[2][0]
             userUrl = user[2][1]
-            self.users[userName] = userUrl        
+            self._users[userName] = userUrl
         return
 
     def displayDetail(self):
         """ Display database detail for a specific database (for testing)
         """
 
-        if not self.detail: # Attempt to get it
-            self.getDetail()
         for itemName, itemValue in self.detail.items():
             if (itemName != 'userList'):
                 print itemName + ": " + itemValue
@@ -524,11 +3016,14 @@ class Database(CloudSitesCommon):
             print
         return
 
-    def createUser(self, username, password):
+    def createUser(self, username, password, reusePage=False):
         """ Create a database user for this database
             ARGS:
                 - username = Database Username (not including the customerid_ part) [a-z 0-9] (max 8 chars)
                 - password = Password for Database User (min 8 chars, max 128 chars)
+                - reusePage = the browser is still on this database's page (the one a successful
+                  createUser/changePassword came back with), do not load it again
+                  (it is loaded anyway if that page has no add user form)
         """
         username = str(username)
         password = str(password)
@@ -544,14 +3039,22 @@ class Database(CloudSitesCommon):
         # We could do validation of the username/password, but it would be better to just let rackspace fail it for now
 
         # Open the Database Page and fill out the "DatabaseForm" (add user form)
-        self._openPath(self.url)
         b = self.browser
-        b.select_form(name='DatabaseForm')
+        if reusePage:
+            try:
+                b.select_form(name='DatabaseForm')
+                b.form.find_control('databaseUsername')
+            except (mechanize.FormNotFoundError, mechanize.ControlNotFoundError):
+                reusePage = False
+        if not reusePage:
+            self._openPath(self.url, force=True)
+            b.select_form(name='DatabaseForm')
         b.form['databaseUsername'] = username
         b.form['databasePassword'] = password
         b.form['databasePasswordConfirm'] = password
-        r = b.submit()
-        html = r.read()
+        html = self._submit()
+        self._invalidate(self.url)
+        self._html = html
         match = re.search(r'error has occurred',html)
         if match:
             raise CloudSitesError("Error adding user")
@@ -578,7 +3081,7 @@ class Database(CloudSitesCommon):
 
         # Open the Database Page and fill out the "DeleteUser" form (doesn't appear to have a name)
         b = self.browser
-        self._openPath(self.url)
+        self._openPath(self.url, force=True)
         for form in b.forms():
             if (form.action.startswith(self.baseURL + '/DeleteDatabaseUsers.do')):
                 break
@@ -606,13 +3109,14 @@ class Database(CloudSitesCommon):
         # We could do validation of the password, but it would be better to just let rackspace fail it for now
 
         # Open the Database Page and fill out the "DatabaseForm"
-        self._openPath(self.users[username])
+        self._openPath(self.users[username], force=True)
         b = self.browser
         b.select_form(name='DatabaseForm')
         b.form['databasePassword'] = password
         b.form['databasePasswordConfirm'] = password
-        r = b.submit()
-        html = r.read()
+        html = self._submit()
+        self._invalidate(self.url, self.users[username])
+        self._html = html
         match = re.search(r'error has occurred',html)
         if match:
             raise CloudSitesError("Error adding user")
@@ -620,3 +3124,642 @@ class Database(CloudSitesCommon):
         self._parseDatabaseDetail(html)
         return True
 
+    def _applyUserJobs(self, jobs, done):
+        """ Run createUser/changePassword jobs one after the other with the same browser, sharing
+            page loads: both come back with the database page, so a createUser right after a
+            successful job fills in the form of that page instead of loading it again
+                ARGS:
+                    - jobs - list of (action, username, password)
+                    - done - called with (index, error or None, seconds) after every job
+        """
+        onPage = False
+        for index, (action, username, password) in enumerate(jobs):
+            started = time.time()
+            error = None
+            try:
+                if action == 'createUser':
+                    self.createUser(username, password, reusePage=onPage)
+                else:
+                    self.changePassword(username, password)
+            except Exception, e:
+                error = e
+            # After an error the browser may be on an error page
+            onPage = error is None
+            done(index, error, time.time() - started)
+        return
+
+
+
+########## CronJob ##########
+class CronJob(CloudSitesCommon):
+    """ Rackspace Cloud Sites scheduled task (cron job)
+            This object belongs to a Website object
+            detail (schedule, command, language, email) is loaded on first access (see getDetail)
+    """
+    __slots__ = ('website', 'websiteID', 'jobID', 'name', 'url', 'rowHash', '_detail',
+                 '_browser', 'cache', 'account', '_html', '_jsMemoData')
+
+    # Detail page item names for each field (the first one found wins)
+    _fieldNames = {
+        'schedule': ('Schedule', 'Frequency'),
+        'command': ('Command To Run', 'Command', 'Script'),
+        'language': ('Command Language', 'Language'),
+        'email': ('Email Output', 'Notification Email', 'Email'),
+    }
+    # Schedule given as separate crontab fields
+    _scheduleNames = ('Minute', 'Hour', 'Day of Month', 'Month', 'Day of Week')
+
+    def __init__(self, website, jobID, name, url):
+        """ INIT for CronJob object
+                ARGS:
+                    - website - link back to parent website object
+                    - jobID - represents jobID in URLs
+                    - name - job name
+                    - url - URL to bring up the job details
+        """
+        self.website = website
+        self.websiteID = website.websiteID
+        self.jobID = str(jobID)
+        self.name = str(name)
+        self.url = str(url)
+        self.rowHash = None
+        self._detail = None
+        self._browser = None
+        self.cache = website.cache
+        self.account = website.account
+        self._html = None
+        self._jsMemoData = None
+        return
+
+    @property
+    def detail(self):
+        """ itemName -> value (loaded on first access)
+        """
+        if self._detail is None:
+            self.getDetail()
+        return self._detail
+
+    @detail.setter
+    def detail(self, detail):
+        self._detail = detail
+
+    def _field(self, field):
+        """ Value of one of the _fieldNames fields from the detail (None if the page lacks it)
+        """
+        detail = self.detail
+        for itemName in self._fieldNames[field]:
+            if itemName in detail:
+                return detail[itemName]
+        if field == 'schedule' and any(itemName in detail for itemName in self._scheduleNames):
+            return ' '.join(detail.get(itemName, '*') for itemName in self._scheduleNames)
+        return None
+
+    @property
+    def schedule(self):
+        """ When the job runs (crontab style, as shown by the control panel)
+        """
+        return self._field('schedule')
+
+    @property
+    def command(self):
+        """ Command (script) the job runs
+        """
+        return self._field('command')
+
+    @property
+    def language(self):
+        """ Command language (e.g. php, perl, python)
+        """
+        return self._field('language')
+
+    @property
+    def email(self):
+        """ Address the job output is sent to
+        """
+        return self._field('email')
+
+    def _children(self):
+        return [ ]
+
+    def toDict(self):
+        """ Plain dict describing this cron job (for JSON output; details only if loaded)
+        """
+        result = {'type': 'cronjob', 'clientID': self.website.clientID, 'websiteID': self.websiteID,
+                  'domainName': self.website.domainName, 'jobID': self.jobID, 'name': self.name,
+                  'url': self.url}
+        if self._detail is not None:
+            for field in ('schedule', 'command', 'language', 'email'):
+                result[field] = self._field(field)
+        return result
+
+    def unload(self):
+        """ Drop the loaded detail (it is loaded again when needed)
+        """
+        self._detail = None
+        self._html = None
+        self._jsMemoData = None
+        return
+
+    def getDetail(self):
+        """ Get the cron job details (schedule, command, language, email)
+        """
+        self._openPath(self.url)
+        started = time.time()
+        html = self._html
+        self._dropPage()
+        parser = _DatabaseDetailParser()
+        parser.feed(html)
+        parser.close()
+        self._emit('parse', varName='cronJobDetail', seconds=time.time() - started, bytes=len(html))
+        if not parser.items:
+            raise CloudSitesError("Error Parsing Cron Job Details")
+        self._detail = dict(parser.items)
+        self.account._loaded(self)
+        return self._detail
+
+    def displayDetail(self):
+        """ Display the cron job details (for testing)
+        """
+        print 'CronJob Name: ' + self.name
+        print 'Schedule: ' + str(self.schedule)
+        print 'Language: ' + str(self.language)
+        print 'Command: ' + str(self.command)
+        print 'Email: ' + str(self.email)
+        print
+        return
+
+
+########## Future ##########
+class Future(object):
+    """ Result of a call running in the background (see AsyncAccount)
+            Use result() to wait for it, or addDoneCallback() to be told when it is done
+            (e.g. to hand it over to an event loop).
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self._callbacks = [ ]
+        self._lock = threading.Lock()
+        return
+
+    def done(self):
+        """ True once the call has finished (successfully or not)
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the call to finish and return its result (or raise its exception)
+        """
+        if not self._done.wait(timeout):
+            raise CloudSitesError("Timed out waiting for result")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def exception(self, timeout=None):
+        """ Wait for the call to finish and return its exception (or None)
+        """
+        if not self._done.wait(timeout):
+            raise CloudSitesError("Timed out waiting for result")
+        return self._error
+
+    def addDoneCallback(self, fn):
+        """ Call fn(future) when the call finishes (right away if it already has)
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+        return
+
+    def _set(self, result=None, error=None):
+        with self._lock:
+            self._result = result
+            self._error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, [ ]
+        for fn in callbacks:
+            fn(self)
+        return
+
+
+def gather(futures):
+    """ Combine several futures into one whose result is the list of their results
+        (in the same order); it fails with the first exception raised by any of them.
+    """
+    futures = list(futures)
+    combined = Future()
+    results = [None] * len(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+    if not futures:
+        combined._set([ ])
+
+    def collect(index, future):
+        error = future.exception()
+        with lock:
+            if combined.done():
+                return
+            if error is not None:
+                combined._set(error=error)
+                return
+            results[index] = future.result()
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                combined._set(results)
+
+    for index, future in enumerate(futures):
+        future.addDoneCallback(lambda future, index=index: collect(index, future))
+    return combined
+
+
+class _Executor(object):
+    """ Fixed pool of worker threads running submitted calls; the number of workers
+        bounds how many requests are in flight at once.
+    """
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self._queue = Queue.Queue()
+        self._threads = [ ]
+        self._lock = threading.Lock()
+        self._stopped = False
+        return
+
+    def submit(self, func, *args):
+        """ Run func(*args) on a worker thread
+            RETURN: Future
+        """
+        with self._lock:
+            if self._stopped:
+                raise CloudSitesError("The worker pool has been closed")
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._work)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+        future = Future()
+        self._queue.put((future, func, args))
+        return future
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, func, args = item
+            try:
+                result = func(*args)
+            except Exception, e:
+                future._set(error=e)
+            else:
+                future._set(result)
+
+    def stop(self):
+        """ Stop the workers once the calls submitted so far have run
+        """
+        with self._lock:
+            self._stopped = True
+            for thread in self._threads:
+                self._queue.put(None)
+        return
+
+
+########## AsyncCommon ##########
+class AsyncCommon(object):
+    """ Common methods for the Async* wrappers
+            Each wrapper runs the methods of the wrapped (synchronous) object on the
+            account's worker pool, with a browser of its own, and returns a Future.
+            Calls on the same object are run one at a time.
+    """
+
+    def _submit(self, method, *args):
+        return self.asyncAccount._executor.submit(self._call, method, args)
+
+    def _call(self, method, args):
+        with self._lock:
+            return self.asyncAccount.account._runWithBrowser(self.obj, method, *args)
+
+
+########## AsyncAccount ##########
+class AsyncAccount(AsyncCommon):
+    """ Non-blocking front end to an Account
+            Every call that talks to Cloud Sites returns a Future; up to "concurrency"
+            pages are fetched at the same time.
+    """
+
+    def __init__(self, account=None, concurrency=8):
+        """ INIT for AsyncAccount
+                ARGS:
+                    - account - Account to wrap (a new one is created if not given)
+                    - concurrency - maximum number of requests in flight
+        """
+        self.account = account if account is not None else Account()
+        self.obj = self.account
+        self.asyncAccount = self
+        self._executor = _Executor(concurrency)
+        self._lock = threading.Lock()
+        self._wrappers = { }
+        self._wrappersLock = threading.Lock()
+        return
+
+    def _wrap(self, cls, obj):
+        """ Return the (single) Async wrapper for obj
+        """
+        with self._wrappersLock:
+            wrapper = self._wrappers.get(id(obj))
+            if wrapper is None or wrapper.obj is not obj:
+                wrapper = cls(self, obj)
+                self._wrappers[id(obj)] = wrapper
+            return wrapper
+
+    def _call(self, method, args):
+        # The account's own calls (login, client list, ...) use its own browser
+        with self._lock:
+            return getattr(self.account, method)(*args)
+
+    def login(self, username, password):
+        """ Login (see Account.login) - RETURN: Future
+        """
+        return self._submit('login', username, password)
+
+    def logout(self):
+        """ Logout (see Account.logout) - RETURN: Future
+        """
+        return self._submit('logout')
+
+    def getClientList(self):
+        """ Obtain the list of clients (see Account.getClientList) - RETURN: Future
+        """
+        return self._submit('getClientList')
+
+    def getClient(self, clientID):
+        """ Obtain a specific AsyncClient with the clientID (from the already loaded list)
+        """
+        client = self.account.getClient(clientID)
+        if client is None:
+            return None
+        return self._wrap(AsyncClient, client)
+
+    def close(self):
+        """ Stop the worker threads once the calls made so far have run (the Account stays
+            usable, this object does not)
+        """
+        self._executor.stop()
+        return
+
+
+########## AsyncClient ##########
+class AsyncClient(AsyncCommon):
+    """ Non-blocking front end to a Client
+    """
+
+    def __init__(self, asyncAccount, client):
+        self.asyncAccount = asyncAccount
+        self.obj = client
+        self._lock = threading.Lock()
+        return
+
+    def getWebsiteList(self):
+        """ Get the websites of this client (see Client.getWebsiteList) - RETURN: Future
+        """
+        return self._submit('getWebsiteList')
+
+    def getUserList(self):
+        """ Get the (S)FTP users of this client (see Client.getUserList) - RETURN: Future
+        """
+        return self._submit('getUserList')
+
+    def getWebsite(self, websiteID):
+        """ Obtain a specific AsyncWebsite with the websiteID (from the already loaded list)
+        """
+        website = self.obj.getWebsite(websiteID)
+        if website is None:
+            return None
+        return self.asyncAccount._wrap(AsyncWebsite, website)
+
+
+########## AsyncWebsite ##########
+class AsyncWebsite(AsyncCommon):
+    """ Non-blocking front end to a Website
+    """
+
+    def __init__(self, asyncAccount, website):
+        self.asyncAccount = asyncAccount
+        self.obj = website
+        self._lock = threading.Lock()
+        return
+
+    def getFeatures(self):
+        """ Get the databases and cron jobs of this website (see Website.getFeatures) - RETURN: Future
+        """
+        return self._submit('getFeatures')
+
+    def getDatabase(self, databaseName):
+        """ Obtain a specific AsyncDatabase with the databaseName (from the already loaded list)
+        """
+        database = self.obj.getDatabase(databaseName)
+        if database is None:
+            return None
+        return self.asyncAccount._wrap(AsyncDatabase, database)
+
+
+########## AsyncDatabase ##########
+class AsyncDatabase(AsyncCommon):
+    """ Non-blocking front end to a Database
+    """
+
+    def __init__(self, asyncAccount, database):
+        self.asyncAccount = asyncAccount
+        self.obj = database
+        self._lock = threading.Lock()
+        return
+
+    def getDetail(self):
+        """ Get the database details (see Database.getDetail) - RETURN: Future
+        """
+        return self._submit('getDetail')
+
+    def createUser(self, username, password):
+        """ Create a database user (see Database.createUser) - RETURN: Future
+        """
+        return self._submit('createUser', username, password)
+
+    def changePassword(self, username, password):
+        """ Change a database user's password (see Database.changePassword) - RETURN: Future
+        """
+        return self._submit('changePassword', username, password)
+
+
+########## CrawlPool ##########
+# Logged in accounts of a CrawlPool worker process: (username, sessionFile) -> Account
+_workerAccounts = { }
+
+def _initCrawlWorker(baseURL):
+    """ CrawlPool worker process setup
+    """
+    CloudSitesCommon.baseURL = baseURL
+    return
+
+def _inventoryRecords(account, clients, name):
+    """ Plain (picklable) dicts describing the loaded data of clients, tagged with the account name
+    """
+    records = [ ]
+    for client in clients:
+        records.append(client.toDict())
+        for userName, (userID, fullName, accessLevel) in sorted((client._users or { }).items()):
+            records.append({'type': 'ftpUser', 'clientID': client.clientID, 'userName': userName,
+                            'userID': userID, 'name': fullName, 'accessLevel': accessLevel})
+        for website in client._children():
+            records.append(website.toDict())
+            records.extend(child.toDict() for child in website._children())
+    for record in records:
+        record['account'] = name
+    return records
+
+def _crawlTask(task):
+    """ Crawl (part of) an account in a CrawlPool worker process
+
+        RETURN: list of records (an 'error' record if it failed)
+    """
+    spec, clientIDs, workers, cronJobs = task
+    name = spec.get('name', spec.get('username'))
+    try:
+        key = (spec.get('username'), spec.get('sessionFile'))
+        account = _workerAccounts.get(key)
+        if account is None:
+            account = Account(pooledTransport=spec.get('pooledTransport', False))
+            account.login(spec.get('username'), spec.get('password'), sessionFile=spec.get('sessionFile'))
+            _workerAccounts[key] = account
+        account.crawl(workers, cronJobs, clientIDs)
+        if clientIDs is None:
+            clients = account.clientList.values()
+        else:
+            clients = [account.clientList[clientID] for clientID in clientIDs if clientID in account.clientList]
+        return _inventoryRecords(account, clients, name)
+    except Exception, e:
+        return [{'type': 'error', 'account': name, 'clientIDs': clientIDs,
+                 'error': str(e.value if isinstance(e, CloudSitesError) else e)}]
+
+
+class CrawlPool(object):
+    """ Crawl several accounts (or slices of the clients of big ones) in worker processes
+            Every worker process logs in on its own (once per account) and sends back plain
+            dict records (the toDict() of clients, websites, databases and cron jobs, plus
+            ftpUser records), each tagged with the account name:
+                pool = CrawlPool([{'name': 'reseller1', 'username': 'u1', 'password': 'p1'},
+                                  {'name': 'reseller2', 'username': 'u2', 'password': 'p2'}])
+                for record in pool.iterRecords():
+                    ...
+    """
+
+    def __init__(self, accounts, processes=4, clientsPerTask=None, workers=2, cronJobs=False):
+        """ INIT for CrawlPool
+                ARGS:
+                    - accounts - list of dicts: username, password (or sessionFile), optional name
+                      (defaults to username) and pooledTransport
+                    - processes - number of worker processes
+                    - clientsPerTask - split each account into tasks of that many clients (the client
+                      lists are fetched here first); None = one task per account
+                    - workers - concurrent browser sessions within each worker process
+                    - cronJobs - fetch cron job details as well
+        """
+        self.accounts = accounts
+        self.processes = processes
+        self.clientsPerTask = clientsPerTask
+        self.workers = workers
+        self.cronJobs = cronJobs
+        return
+
+    def tasks(self):
+        """ The (account, clientIDs, workers, cronJobs) tasks handed to the worker processes
+        """
+        tasks = [ ]
+        for spec in self.accounts:
+            if self.clientsPerTask is None:
+                tasks.append((spec, None, self.workers, self.cronJobs))
+                continue
+            account = Account()
+            account.login(spec.get('username'), spec.get('password'), sessionFile=spec.get('sessionFile'))
+            clientIDs = sorted(account.getClientList())
+            for start in range(0, len(clientIDs), self.clientsPerTask):
+                tasks.append((spec, clientIDs[start:start + self.clientsPerTask], self.workers, self.cronJobs))
+        return tasks
+
+    def iterRecords(self):
+        """ Yield the records as the worker processes finish their tasks
+        """
+        tasks = self.tasks()
+        pool = multiprocessing.Pool(max(1, min(self.processes, len(tasks))), _initCrawlWorker,
+                                    (CloudSitesCommon.baseURL,))
+        try:
+            for records in pool.imap_unordered(_crawlTask, tasks):
+                for record in records:
+                    yield record
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        return
+
+    def inventory(self):
+        """ Crawl everything and merge the records into one inventory
+
+            RETURN: dict record type ('client', 'ftpUser', 'website', 'database', 'cronjob',
+                    'error') -> list of records
+        """
+        inventory = { }
+        for record in self.iterRecords():
+            inventory.setdefault(record['type'], [ ]).append(record)
+        return inventory
+
+
+########## Command Line ##########
+def main(args=None):
+    """ Stream clients, websites, databases or cron jobs of an account as NDJSON
+        (one JSON object per line, written as soon as it is parsed)
+
+        Credentials come from --username/--password, the CLOUDSITES_USERNAME and
+        CLOUDSITES_PASSWORD environment variables, or a prompt.
+    """
+    parser = argparse.ArgumentParser(description='Rackspace Cloud Sites inventory as NDJSON')
+    parser.add_argument('what', choices=('clients', 'websites', 'databases', 'cronjobs'))
+    parser.add_argument('--username', default=os.environ.get('CLOUDSITES_USERNAME'))
+    parser.add_argument('--password', default=os.environ.get('CLOUDSITES_PASSWORD'))
+    parser.add_argument('--session-file', help='reuse/save the login session in this file')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent browser sessions')
+    parser.add_argument('--no-detail', action='store_true', help='skip database / cron job detail pages')
+    parser.add_argument('--budget', type=int, default=None,
+                        help='keep at most this many objects loaded (see Account.childBudget)')
+    options = parser.parse_args(args)
+
+    account = Account()
+    account.childBudget = options.budget
+    username = options.username
+    password = options.password
+    if username is None and options.session_file is None:
+        username = raw_input('Username: ')
+    if password is None and username is not None:
+        password = getpass.getpass('Password: ')
+    account.login(username, password, sessionFile=options.session_file)
+
+    if options.what == 'clients':
+        records = (client.toDict() for client in account.iterClients())
+    elif options.what == 'websites':
+        records = (website.toDict() for website in account.iterWebsites(options.workers))
+    elif options.what == 'databases':
+        records = (db.toDict() for db in account.iterDatabases(options.workers, not options.no_detail))
+    else:
+        records = (job.toDict() for job in account.iterCronJobs(options.workers, not options.no_detail))
+    for record in records:
+        sys.stdout.write(json.dumps(record) + '\n')
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Benchmark: full account crawl against the local stand-in
+
+    Starts benchmarks/standin.py (synthetic account or recorded fixtures), crawls it
+    with Account.crawl() for each worker count (with mechanize's default transport and
+    with the pooled keep-alive / gzip one) and reports pages/sec, then times the
+    parsing of every page type (tableDataN extraction, database detail parsing) and
+    prints the Stats collected during the last crawl.
+
+    Usage: python benchmarks/bench_crawl.py [--clients 20] [--websites 5] [--latency 0.02]
+                                            [--workers 1,4,8] [--fixtures dir] [--transport both]
+"""
+
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import CloudSitesAutomate
+from standin import StandIn
+
+
+class _Page(CloudSitesAutomate.CloudSitesCommon):
+    """ Just enough of an object to run the parsers on a stored page
+    """
+    __slots__ = ('_html', '_jsMemoData', 'account', '_browser', 'cache')
+
+    def __init__(self, html):
+        self._html = html
+        self._jsMemoData = None
+        self.account = None
+        self._browser = None
+        self.cache = None
+
+
+def crawl(standIn, workers, pooled=False):
+    """ Crawl the stand-in once - RETURN: (seconds, pages fetched, account)
+        (account.stats holds the Stats collected during the crawl)
+    """
+    account = CloudSitesAutomate.Account(pooledTransport=pooled)
+    account.stats = CloudSitesAutomate.Stats()
+    account.addHook(account.stats)
+    account.login(standIn.username, standIn.password)
+    before = sum(standIn.requests.values())
+    start = time.time()
+    account.crawl(workers)
+    elapsed = time.time() - start
+    return elapsed, sum(standIn.requests.values()) - before, account
+
+
+def parseTimes(account, number=20):
+    """ Average parse time (ms) per page type, using the pages in the account's page cache
+    """
+    samples = { }
+    for url, (stored, html) in account.cache._entries.items():
+        pageType = CloudSitesAutomate._pageType(url)
+        samples.setdefault(pageType, [ ]).append(html)
+    results = { }
+    for pageType, pages in sorted(samples.items()):
+        pages = pages[:50]
+
+        def parse():
+            for html in pages:
+                page = _Page(html)
+                for index in range(4):
+                    try:
+                        page._parseForJsVarPart('tableData%d' % index)
+                    except CloudSitesAutomate.CloudSitesError:
+                        break
+                if pageType == 'Database':
+                    parser = CloudSitesAutomate._DatabaseDetailParser()
+                    parser.feed(html)
+                    parser.close()
+        seconds = timeit.timeit(parse, number=number) / number / len(pages)
+        results[pageType] = (seconds * 1000, sum(len(html) for html in pages) / len(pages))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawl benchmark against the local stand-in')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--websites', type=int, default=5, help='websites per client')
+    parser.add_argument('--databases', type=int, default=1, help='databases per website')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every request')
+    parser.add_argument('--workers', default='1,4,8', help='comma separated worker counts')
+    parser.add_argument('--fixtures', help='directory written by CloudSitesAutomate.PageRecorder')
+    parser.add_argument('--transport', choices=['default', 'pooled', 'both'], default='both')
+    options = parser.parse_args()
+
+    standIn = StandIn(options.clients, options.websites, options.databases,
+                      latency=options.latency, fixtures=options.fixtures)
+    CloudSitesAutomate.CloudSitesCommon.baseURL = standIn.start()
+    try:
+        print 'Crawl (%d clients x %d websites, %.0f ms latency)' % (
+            options.clients, options.websites, options.latency * 1000)
+        account = None
+        transports = {'default': [False], 'pooled': [True], 'both': [False, True]}[options.transport]
+        for pooled in transports:
+            for workers in [int(w) for w in options.workers.split(',')]:
+                connections, sent = standIn.connections, standIn.bytesSent
+                elapsed, pages, account = crawl(standIn, workers, pooled)
+                print '  %-7s workers %3d: %5d pages in %7.2f s = %8.1f pages/sec, %5d connections, %9d bytes' % (
+                    'pooled' if pooled else 'default', workers, pages, elapsed, pages / elapsed,
+                    standIn.connections - connections, standIn.bytesSent - sent)
+        print
+        print 'Parse time per page type'
+        for pageType, (ms, size) in sorted(parseTimes(account).items()):
+            print '  %-20s %9d bytes  %8.3f ms' % (pageType, size, ms)
+        print
+        print 'Instrumentation of the last crawl'
+        print account.stats.report()
+    finally:
+        standIn.stop()
@@ -0,0 +1,73 @@
+"""
+Benchmark: import time of CloudSitesAutomate
+
+    Times, in fresh interpreters, the import of the module and a snapshot only run
+    (import, Account().loadSnapshot() of an empty snapshot, diffAccounts) and checks that
+    neither of them imports the networking modules (mechanize, httplib, urllib, ...).
+    Exits with status 1 if one of them does, or if the median import time is over --max-ms,
+    so it can guard against regressions.
+
+    Usage: python benchmarks/bench_import.py [--runs 20] [--max-ms 50]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules that must only be imported once a request is made
+NETWORK_MODULES = ['mechanize', 'httplib', 'urllib', 'urllib2', 'socket', 'ssl', 'multiprocessing', 'argparse']
+
+SCENARIOS = {
+    'import': 'import CloudSitesAutomate',
+    'snapshot': ('import CloudSitesAutomate\n'
+                 'account = CloudSitesAutomate.Account()\n'
+                 'account.loadSnapshot(%(snapshot)r)\n'
+                 'CloudSitesAutomate.diffAccounts(account, %(snapshot)r)'),
+}
+
+PROBE = """
+import sys, time
+started = time.time()
+%s
+elapsed = time.time() - started
+print repr((elapsed * 1000, sorted(name for name in %r if name in sys.modules)))
+"""
+
+
+def run(code):
+    """ Run code in a fresh interpreter - RETURN: (milliseconds, networking modules imported)
+    """
+    output = subprocess.check_output([sys.executable, '-c', PROBE % (code, NETWORK_MODULES)], cwd=ROOT)
+    return eval(output.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time of CloudSitesAutomate')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if the median import takes longer')
+    options = parser.parse_args()
+
+    snapshot = os.path.join(tempfile.mkdtemp(), 'empty.db')
+    failed = False
+    for name in sorted(SCENARIOS):
+        code = SCENARIOS[name] % {'snapshot': snapshot}
+        results = [run(code) for index in range(options.runs)]
+        times = [milliseconds for milliseconds, modules in results]
+        imported = results[-1][1]
+        print '%-10s median %7.1f ms  min %7.1f ms  max %7.1f ms  networking modules: %s' % (
+            name, median(times), min(times), max(times), ', '.join(imported) or 'none')
+        if imported:
+            failed = True
+        if name == 'import' and options.max_ms is not None and median(times) > options.max_ms:
+            print '  median import time over %.1f ms' % options.max_ms
+            failed = True
+    sys.exit(1 if failed else 0)
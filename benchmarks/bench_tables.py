@@ -0,0 +1,132 @@
+"""
+Benchmark: tableDataN extraction from large listing pages
+
+    Compares the extraction CloudSitesCommon._parseForJsVarPart used to do (a lazy regex
+    copying every tableDataN block out of the page, then decoding the copy) with the
+    current one (offsets of the blocks, one copy of the block decoded) on client lists:
+    throughput, and the peak memory of each, measured in a fresh interpreter per page.
+
+    Usage: python benchmarks/bench_tables.py [--clients 1000,10000,50000] [--fixtures dir] [page.html ...]
+    With --fixtures the ClientList pages recorded by CloudSitesAutomate.PageRecorder are used,
+    with page files those, otherwise synthetic client lists of each --clients size.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import CloudSitesAutomate
+from bench_crawl import _Page
+from standin import _tablePage
+
+_legacyPattern = re.compile(r'^\s*(?P<name>tableData\d+):\n*"(?P<value>.*?)",$', re.MULTILINE|re.DOTALL)
+
+
+def legacyParse(html, varName='tableData0'):
+    """ The extraction _parseForJsVarPart used to do
+    """
+    parts = { }
+    for match in _legacyPattern.finditer(html):
+        parts.setdefault(match.group('name'), match.group('value'))
+    data = parts[varName].replace('\n','').replace(r'\"', '"').replace(r'\\"', r'\"')
+    return json.loads(data)
+
+
+def currentParse(html, varName='tableData0'):
+    """ The offsets based extraction of _parseForJsVarPart
+    """
+    return _Page(html)._parseForJsVarPart(varName)
+
+
+PARSERS = {'legacy': legacyParse, 'current': currentParse}
+
+
+def clientListPage(clients):
+    """ A ClientList.do page listing "clients" clients on one page (some names need escaping)
+    """
+    rows = [[0, '', str(100000 + index),
+             ['Client "%d" \\ Co' % index if index % 50 == 0 else 'Client %d' % index,
+              '/ClientSettings.do?accountID=%d' % (100000 + index)]]
+            for index in range(clients)]
+    return _tablePage([{'rows': rows, 'totalRows': clients, 'pageSize': clients, 'page': 1}])
+
+
+def fixturePages(directory):
+    """ RETURN: list of (name, path) of the ClientList pages recorded in directory
+    """
+    with open(os.path.join(directory, 'index.json')) as f:
+        index = json.load(f)
+    return [(path, os.path.join(directory, filename)) for path, filename in sorted(index.items())
+            if CloudSitesAutomate._pageType(path) == 'ClientList']
+
+
+def residentKB(name):
+    """ VmRSS (resident size) or VmHWM (its high water mark) of this process, in kB
+    """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(name + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def peakMemory(parser, path):
+    """ Peak memory (bytes) parsing the page in path takes, on top of the page itself
+        (in a fresh interpreter, so earlier runs do not count)
+    """
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--memory', parser, path])
+    return int(output.strip().splitlines()[-1])
+
+
+def bench(name, path, number):
+    with open(path) as f:
+        html = f.read()
+    same = legacyParse(html) == currentParse(html)
+    line = '%-30s %10d bytes' % (name[-30:], len(html))
+    for parser in ('legacy', 'current'):
+        seconds = timeit.timeit(lambda: PARSERS[parser](html), number=number) / number
+        line += '  %s %8.2f ms %6.1f MB/s %7.1f MB peak' % (
+            parser, seconds * 1000, len(html) / seconds / 1e6, peakMemory(parser, path) / 1e6)
+    print line + '  same result: %s' % same
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--memory':
+        # Child process of peakMemory (Linux): reset the resident size high water mark once
+        # the page is read, parse, then compare the high water mark with the size before
+        with open(sys.argv[3]) as f:
+            html = f.read()
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        before = residentKB('VmRSS')
+        PARSERS[sys.argv[2]](html)
+        print (residentKB('VmHWM') - before) * 1024
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='tableDataN extraction benchmark')
+    parser.add_argument('--clients', default='1000,10000,50000', help='comma separated client counts')
+    parser.add_argument('--fixtures', help='directory written by CloudSitesAutomate.PageRecorder')
+    parser.add_argument('--number', type=int, default=5, help='runs to average')
+    parser.add_argument('pages', nargs='*', help='recorded page files')
+    options = parser.parse_args()
+
+    if options.fixtures:
+        pages = fixturePages(options.fixtures)
+    elif options.pages:
+        pages = [(path, path) for path in options.pages]
+    else:
+        directory = tempfile.mkdtemp()
+        pages = [ ]
+        for clients in [int(c) for c in options.clients.split(',')]:
+            path = os.path.join(directory, 'clients%d.html' % clients)
+            with open(path, 'w') as f:
+                f.write(clientListPage(clients))
+            pages.append(('synthetic (%d clients)' % clients, path))
+    for name, path in pages:
+        bench(name, path, options.number)
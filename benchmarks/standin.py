@@ -0,0 +1,377 @@
+"""
+Local stand-in for the Rackspace Cloud Sites control panel
+
+    Serves just enough of the control panel for CloudSitesAutomate to run against:
+    /Login.do, /Home.do, /Logout.do, /ClientList.do, /ClientWebsiteList.do,
+    /FTPSettings.do, /WebsiteFeatures.do, /Database.do, /DatabaseUser.do and /CronJob.do
+    (including the DatabaseForm posts used by createUser / changePassword).
+
+    Pages come from a synthetic account of configurable size, or from fixtures
+    recorded with CloudSitesAutomate.PageRecorder. A per-request latency can be
+    added to look like the real thing. Listings are paged (?page=N&pageSize=M, the page
+    size capped at maxPageSize) with totalRows/pageSize/page in each tableDataN. Pages are gzip compressed for clients sending
+    Accept-Encoding: gzip, and connections are kept alive (HTTP/1.1).
+
+    Usage (as a script): python benchmarks/standin.py --clients 50 --latency 0.05 --port 8080
+    Usage (from python):
+        standIn = StandIn(clients=50, latency=0.05)
+        CloudSitesAutomate.CloudSitesCommon.baseURL = standIn.start()
+        ...
+        standIn.stop()
+"""
+
+import BaseHTTPServer
+import Cookie
+import SocketServer
+import argparse
+import json
+import os
+import threading
+import time
+import urlparse
+import zlib
+
+
+def _tableData(table):
+    """ Encode a table (rows and paging metadata) the way the control panel embeds it in the page
+    """
+    if isinstance(table, list):
+        table = {'rows': table}
+    return json.dumps(table).replace('"', r'\"')
+
+
+def _tablePage(tables, before='', pageSize=25):
+    """ A page with a listTableArgs block holding tableData0..N (lists of rows or table dicts)
+    """
+    html = '<html><body>' + before + '\n<script type="text/javascript">\nvar listTableArgs = {\n'
+    for index, table in enumerate(tables):
+        html += '    tableData%d:\n"%s",\n' % (index, _tableData(table))
+    return html + '    pageSize: %d\n};\n</script>\n</body></html>\n' % pageSize
+
+
+########## StandIn ##########
+class StandIn(object):
+    """ Threaded HTTP server playing the control panel
+    """
+
+    def __init__(self, clients=10, websites=5, databases=1, cronJobs=1, dbUsers=2, latency=0.0,
+                 fixtures=None, username='demo', password='demo', sessionTimeout=None, port=0,
+                 pageSize=25, maxPageSize=100):
+        """ INIT for StandIn
+                ARGS:
+                    - clients / websites / databases / cronJobs / dbUsers - synthetic account size
+                      (websites per client, databases, cron jobs and users per website/database)
+                    - latency - seconds added to every request
+                    - fixtures - directory written by PageRecorder (recorded pages win over synthetic ones)
+                    - username / password - accepted credentials
+                    - sessionTimeout - seconds after which a session stops working (None = never)
+                    - port - port to listen on (0 = any free port)
+                    - pageSize / maxPageSize - default and largest page size of the listings
+        """
+        self.clients = clients
+        self.websites = websites
+        self.databases = databases
+        self.cronJobs = cronJobs
+        self.dbUsers = dbUsers
+        self.latency = latency
+        self.username = username
+        self.password = password
+        self.sessionTimeout = sessionTimeout
+        self.port = port
+        self.pageSize = pageSize
+        self.maxPageSize = maxPageSize
+        self.fixtures = { }
+        self.fixturesDir = fixtures
+        if fixtures is not None:
+            with open(os.path.join(fixtures, 'index.json')) as f:
+                self.fixtures = json.load(f)
+        self.requests = { }         # page type -> number of requests served
+        self.bytesServed = 0
+        self.bytesSent = 0          # after compression
+        self.connections = 0        # TCP connections accepted
+        self.sessions = { }         # session id -> time of login
+        self.extraUsers = { }       # database name -> {userName: password}
+        self._lock = threading.Lock()
+        self._server = None
+        self.baseURL = None
+        return
+
+    def start(self):
+        """ Start serving in a background thread
+            RETURN: base URL of the stand-in
+        """
+        standIn = self
+
+        class Handler(_Handler):
+            pass
+        Handler.standIn = standIn
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+            request_queue_size = 128
+
+        self._server = Server(('127.0.0.1', self.port), Handler)
+        self.baseURL = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.baseURL
+
+    def stop(self):
+        """ Stop serving
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        return
+
+    def expireSessions(self):
+        """ Make every current session time out (to exercise re-login)
+        """
+        with self._lock:
+            self.sessions.clear()
+        return
+
+    def _count(self, pageType, size):
+        with self._lock:
+            self.requests[pageType] = self.requests.get(pageType, 0) + 1
+            self.bytesServed += size
+        return
+
+    ## Synthetic account
+
+    def clientIDs(self):
+        return [str(100000 + i) for i in range(self.clients)]
+
+    def websiteIDs(self, clientID):
+        return ['%s%03d' % (clientID, j) for j in range(self.websites)]
+
+    def databaseNames(self, websiteID):
+        return ['%s_db%d' % (websiteID, k) for k in range(self.databases)]
+
+    def loginPage(self):
+        return ('<html><body><form name="loginForm" method="POST" action="%s/Login.do">'
+                '<input type="text" name="username"/><input type="password" name="password"/>'
+                '<input type="submit" value="Log In"/></form></body></html>' % self.baseURL)
+
+    def homePage(self):
+        return ('<html><body><div id="user">You are logged in as: <strong>%s</strong>, '
+                'Demo Account (#100000)</div></body></html>' % self.username)
+
+    def listingPage(self, query, tables):
+        """ Page "page" of a listing (every table is paged the same way)
+        """
+        try:
+            pageSize = min(int(query.get('pageSize', self.pageSize)), self.maxPageSize)
+            page = max(int(query.get('page', 1)), 1)
+        except ValueError:
+            pageSize, page = self.pageSize, 1
+        start = (page - 1) * pageSize
+        return _tablePage([{'rows': rows[start:start + pageSize], 'totalRows': len(rows),
+                            'pageSize': pageSize, 'page': page} for rows in tables], pageSize=pageSize)
+
+    def clientListPage(self, query):
+        rows = [[0, '', clientID, ['Client %s' % clientID, '/ClientSettings.do?accountID=' + clientID]]
+                for clientID in self.clientIDs()]
+        return self.listingPage(query, [rows])
+
+    def websiteListPage(self, query):
+        clientID = query.get('accountID', '')
+        rows = [[[websiteID, '', ''], 'Full',
+                 ['www%s.example.com' % websiteID,
+                  '/WebsiteSettings.do?accountID=%s&siteID=%s' % (clientID, websiteID)],
+                 'site%s' % websiteID]
+                for websiteID in self.websiteIDs(clientID)]
+        return self.listingPage(query, [rows])
+
+    def ftpSettingsPage(self, query):
+        clientID = query.get('accountID', '')
+        rows = [[['u' + clientID, '', ''], 'ftp' + clientID, 'Primary User', '', '/']]
+        return self.listingPage(query, [rows])
+
+    def featuresPage(self, query):
+        websiteID = query.get('siteID', '')
+        databases = [['', index, [name, '/Database.do?accountID=%s&dbName=%s' % (query.get('accountID', ''), name)],
+                      'MySQL 5'] for index, name in enumerate(self.databaseNames(websiteID))]
+        cronJobs = [[['job%s_%d' % (websiteID, k), '', ''], k,
+                     ['job%s_%d' % (websiteID, k), '/CronJob.do?siteID=%s&jobID=%d' % (websiteID, k)]]
+                    for k in range(self.cronJobs)]
+        return self.listingPage(query, [databases, cronJobs])
+
+    def cronJobPage(self, query):
+        websiteID = query.get('siteID', '')
+        jobID = int(query.get('jobID', 0) or 0)
+        items = [('Task Name', 'job%s_%d' % (websiteID, jobID)),
+                 ('Command Language', ('php', 'perl', 'python')[jobID % 3]),
+                 ('Command To Run', '/mnt/stor1-wc1/%s/web/content/cron/task%d.php' % (websiteID, jobID)),
+                 ('Schedule', '%d * * * *' % (jobID * 5 % 60)),
+                 ('Email Output', 'admin@www%s.example.com' % websiteID)]
+        rows = ''.join('<tr><td class="itemName">%s</td><td class="item">%s</td></tr>' % item for item in items)
+        return '<html><body><table class="detail">' + rows + '</table></body></html>'
+
+    def databaseUsers(self, name):
+        users = ['%s_u%d' % (name[-10:], k) for k in range(self.dbUsers)]
+        return users + sorted(self.extraUsers.get(name, { }))
+
+    def databasePage(self, query):
+        name = query.get('dbName', '')
+        detail = ('<table class="detail">'
+                  '<tr><td class="itemName">Database Name</td><td class="item">%s</td></tr>'
+                  '<tr><td class="itemName">Server</td><td class="item">mysql50-%d.wc1.example.com</td></tr>'
+                  '<tr><td class="itemName">Type</td><td class="item">MySQL 5</td></tr>'
+                  '<tr><td class="itemName">Admin</td><td class="item"><a href="https://mysql.example.com/?db=%s">'
+                  'Manage</a></td></tr></table>' % (name, len(name) % 7, name))
+        form = ('<form name="DatabaseForm" method="POST" action="/DatabaseUser.do?dbName=%s">'
+                '<input type="text" name="databaseUsername"/><input type="password" name="databasePassword"/>'
+                '<input type="password" name="databasePasswordConfirm"/></form>' % name)
+        rows = [[[user, '', ''], index, [user, '/DatabaseUser.do?dbName=%s&user=%s' % (name, user)]]
+                for index, user in enumerate(self.databaseUsers(name))]
+        return _tablePage([rows], detail + form)
+
+    def databaseUserPage(self, query):
+        name = query.get('dbName', '')
+        form = ('<form name="DatabaseForm" method="POST" action="/DatabaseUser.do?dbName=%s&user=%s">'
+                '<input type="password" name="databasePassword"/>'
+                '<input type="password" name="databasePasswordConfirm"/></form>' % (name, query.get('user', '')))
+        return '<html><body>' + form + '</body></html>'
+
+    def saveDatabaseUser(self, query, form):
+        name = query.get('dbName', '')
+        password = form.get('databasePassword', '')
+        if len(password) < 8 or password != form.get('databasePasswordConfirm'):
+            return '<html><body>An error has occurred</body></html>'
+        username = form.get('databaseUsername') or query.get('user')
+        if username:
+            with self._lock:
+                self.extraUsers.setdefault(name, { })[username] = password
+        return self.databasePage({'dbName': name})
+
+    pages = {
+        '/ClientList.do': 'clientListPage',
+        '/ClientWebsiteList.do': 'websiteListPage',
+        '/FTPSettings.do': 'ftpSettingsPage',
+        '/WebsiteFeatures.do': 'featuresPage',
+        '/Database.do': 'databasePage',
+        '/DatabaseUser.do': 'databaseUserPage',
+        '/CronJob.do': 'cronJobPage',
+    }
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Request handler for StandIn (standIn is set on a subclass per server)
+    """
+    standIn = None
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1           # one write per response (small writes + Nagle stall kept-alive connections)
+
+    def log_message(self, format, *args):
+        return
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.standIn._lock:
+            self.standIn.connections += 1
+        return
+
+    def _send(self, body, code=200, headers=()):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if body and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        with self.standIn._lock:
+            self.standIn.bytesSent += len(body)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def _session(self):
+        cookie = Cookie.SimpleCookie(self.headers.get('Cookie', ''))
+        if 'JSESSIONID' not in cookie:
+            return None
+        session = cookie['JSESSIONID'].value
+        standIn = self.standIn
+        with standIn._lock:
+            started = standIn.sessions.get(session)
+            if started is None:
+                return None
+            if standIn.sessionTimeout is not None and time.time() - started > standIn.sessionTimeout:
+                del standIn.sessions[session]
+                return None
+        return session
+
+    def _serve(self, method, form=None):
+        standIn = self.standIn
+        if standIn.latency:
+            time.sleep(standIn.latency)
+        url = urlparse.urlsplit(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        pageType = url.path.strip('/').replace('.do', '') or 'root'
+
+        if url.path == '/Login.do':
+            if method == 'POST':
+                if form.get('username') == standIn.username and form.get('password') == standIn.password:
+                    session = os.urandom(8).encode('hex')
+                    with standIn._lock:
+                        standIn.sessions[session] = time.time()
+                    standIn._count('Login', 0)
+                    return self._send('', 302, [('Location', standIn.baseURL + '/Home.do'),
+                                                ('Set-Cookie', 'JSESSIONID=%s; Path=/' % session)])
+            body = standIn.loginPage()
+        elif url.path == '/robots.txt':
+            return self._send('', 404)
+        elif self._session() is None:
+            # Not logged in (or timed out): the control panel shows the login page
+            body = standIn.loginPage()
+            pageType = 'Login'
+        elif url.path == '/Home.do':
+            body = standIn.homePage()
+        elif url.path == '/Logout.do':
+            body = standIn.loginPage()
+        elif method == 'POST' and url.path == '/DatabaseUser.do':
+            body = standIn.saveDatabaseUser(query, form)
+        elif self.path in standIn.fixtures:
+            with open(os.path.join(standIn.fixturesDir, standIn.fixtures[self.path])) as f:
+                body = f.read().replace('{{baseURL}}', standIn.baseURL)
+        elif url.path in standIn.pages:
+            body = getattr(standIn, standIn.pages[url.path])(query)
+        else:
+            return self._send('<html><body>Not Found</body></html>', 404)
+        standIn._count(pageType, len(body))
+        return self._send(body)
+
+    def do_GET(self):
+        return self._serve('GET')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = dict(urlparse.parse_qsl(self.rfile.read(length)))
+        return self._serve('POST', form)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Cloud Sites control panel')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--websites', type=int, default=5, help='websites per client')
+    parser.add_argument('--databases', type=int, default=1, help='databases per website')
+    parser.add_argument('--cron-jobs', type=int, default=1, help='cron jobs per website')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--fixtures', help='directory written by CloudSitesAutomate.PageRecorder')
+    parser.add_argument('--max-page-size', type=int, default=100, help='largest page size of the listings')
+    options = parser.parse_args()
+    standIn = StandIn(options.clients, options.websites, options.databases, options.cron_jobs,
+                      latency=options.latency, fixtures=options.fixtures, port=options.port,
+                      maxPageSize=options.max_page_size)
+    print 'Serving on ' + standIn.start() + ' (login: demo / demo)'
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        standIn.stop()
@@ -0,0 +1,324 @@
+"""
+Tests: CloudSitesAutomate against the control panel stand-in
+
+    Every test starts a benchmarks/standin.py stand-in with a small synthetic account and
+    drives an Account (or AsyncAccount) against it: login and crawl, the pooled transport,
+    re-login after the sessions time out, paging, snapshots, the async layer, the lookup
+    indexes and bulk database user jobs.
+
+    Usage: python -m unittest discover tests   (needs mechanize, like CloudSitesAutomate)
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'),
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')]
+import CloudSitesAutomate
+from standin import StandIn
+
+
+class StandInTestCase(unittest.TestCase):
+    """ Starts a stand-in (standInOptions) for every test and points CloudSitesAutomate at it
+    """
+
+    standInOptions = {'clients': 3, 'websites': 2, 'databases': 1, 'cronJobs': 2, 'dbUsers': 2}
+
+    def setUp(self):
+        self.standIn = StandIn(**self.standInOptions)
+        self.baseURL = CloudSitesAutomate.CloudSitesCommon.baseURL
+        CloudSitesAutomate.CloudSitesCommon.baseURL = self.standIn.start()
+        self.directory = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        self.standIn.stop()
+        CloudSitesAutomate.CloudSitesCommon.baseURL = self.baseURL
+        shutil.rmtree(self.directory, True)
+        return
+
+    def login(self, **options):
+        """ RETURN: Account logged in to the stand-in (options go to Account())
+        """
+        account = CloudSitesAutomate.Account(**options)
+        account.reloginBackoff = 0
+        account.login(self.standIn.username, self.standIn.password)
+        return account
+
+    def databases(self, account):
+        return [db for client in account.clientList.values()
+                for website in client.websites.values() for db in website.databaseList.values()]
+
+
+class CrawlTest(StandInTestCase):
+
+    def checkCrawl(self, account):
+        options = self.standInOptions
+        clients = account.crawl(2, cronJobs=True)
+        self.assertEqual(sorted(clients), sorted(self.standIn.clientIDs()))
+        for client in clients.values():
+            self.assertEqual(sorted(client.websites), sorted(self.standIn.websiteIDs(client.clientID)))
+            for website in client.websites.values():
+                self.assertEqual(len(website.databaseList), options['databases'])
+                self.assertEqual(len(website.cronJobs), options['cronJobs'])
+                for job in website.cronJobs.values():
+                    self.assertTrue(job.detail)
+        for db in self.databases(account):
+            self.assertTrue(db.detail)
+            self.assertEqual(len(db.users), options['dbUsers'])
+        return
+
+    def testLoginAndCrawl(self):
+        self.checkCrawl(self.login())
+        return
+
+    def testWrongPassword(self):
+        account = CloudSitesAutomate.Account()
+        self.assertRaises(CloudSitesAutomate.CloudSitesError, account.login, 'demo', 'wrong')
+        self.assertFalse(account.authenticated)
+        return
+
+    def testPooledTransport(self):
+        self.checkCrawl(self.login(pooledTransport=True))
+        # Keep-alive: far fewer connections than requests
+        self.assertLess(self.standIn.connections, sum(self.standIn.requests.values()) / 2)
+        self.assertLess(self.standIn.bytesSent, self.standIn.bytesServed)
+        return
+
+    def testReloginAfterSessionsExpire(self):
+        account = self.login()
+        clientIDs = account.getClientList()
+        logins = self.standIn.requests['Login']
+        self.standIn.expireSessions()
+        account.cache.clear()
+        self.assertEqual(account.getClientList(), clientIDs)
+        self.assertGreater(self.standIn.requests['Login'], logins)
+        return
+
+
+class PagingTest(StandInTestCase):
+
+    standInOptions = {'clients': 23, 'websites': 12, 'databases': 1, 'cronJobs': 7, 'dbUsers': 1,
+                      'maxPageSize': 5}
+
+    def testPagedListings(self):
+        account = self.login()
+        clientIDs = account.getClientList()
+        self.assertEqual(sorted(clientIDs), sorted(self.standIn.clientIDs()))
+        self.assertEqual(len(set(clientIDs)), len(clientIDs))
+        self.assertEqual(self.standIn.requests['ClientList'], 5)
+        client = account.clientList[clientIDs[0]]
+        self.assertEqual(sorted(client.getWebsiteList()), sorted(self.standIn.websiteIDs(client.clientID)))
+        website = client.websites.values()[0]
+        website.getFeatures()
+        self.assertEqual(len(website.cronJobs), 7)
+        return
+
+
+class SnapshotTest(StandInTestCase):
+
+    def testRoundTrip(self):
+        account = self.login()
+        account.crawl(2, cronJobs=True)
+        path = os.path.join(self.directory, 'account.db')
+        account.saveSnapshot(path)
+        self.assertEqual(CloudSitesAutomate.diffAccounts(path, account), [ ])
+
+        loaded = CloudSitesAutomate.Account(cacheSize=0)
+        loaded.loadSnapshot(path)
+        self.assertEqual(sorted(loaded.clientList), sorted(account.clientList))
+        self.assertEqual(CloudSitesAutomate.diffAccounts(loaded, account), [ ])
+
+        db = self.databases(account)[0]
+        db.detail = dict(db.detail, Server='other')
+        changes = CloudSitesAutomate.diffAccounts(path, account)
+        self.assertEqual([(change['change'], change['type'], change['fields']) for change in changes],
+                         [('modified', 'database', ['detail'])])
+        return
+
+    def testPartialSnapshot(self):
+        account = self.login()
+        account.getClientList()
+        client = account.clientList.values()[0]
+        client.websites.values()[0].getFeatures()
+        path = os.path.join(self.directory, 'account.db')
+        account.saveSnapshot(path)
+        self.assertEqual(CloudSitesAutomate.diffAccounts(path, account), [ ])
+
+        loaded = CloudSitesAutomate.Account(cacheSize=0)
+        loaded.loadSnapshot(path)
+        # What was not loaded when saving stays unloaded
+        for clientID, other in loaded.clientList.items():
+            self.assertEqual(other._websites is None, account.clientList[clientID]._websites is None)
+        return
+
+
+class AsyncTest(StandInTestCase):
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        self.asyncAccount = CloudSitesAutomate.AsyncAccount(concurrency=4)
+        return
+
+    def tearDown(self):
+        self.asyncAccount.close()
+        StandInTestCase.tearDown(self)
+        return
+
+    def testGather(self):
+        asyncAccount = self.asyncAccount
+        self.assertTrue(asyncAccount.login(self.standIn.username, self.standIn.password).result(10))
+        clientIDs = asyncAccount.getClientList().result(10)
+        self.assertEqual(sorted(clientIDs), sorted(self.standIn.clientIDs()))
+
+        clients = [asyncAccount.getClient(clientID) for clientID in clientIDs]
+        websiteIDs = CloudSitesAutomate.gather(client.getWebsiteList() for client in clients).result(10)
+        self.assertEqual([sorted(ids) for ids in websiteIDs],
+                         [sorted(self.standIn.websiteIDs(clientID)) for clientID in clientIDs])
+
+        website = clients[0].getWebsite(websiteIDs[0][0])
+        databaseNames, cronList = website.getFeatures().result(10)
+        db = website.getDatabase(databaseNames[0])
+        db.getDetail().result(10)
+        self.assertEqual(len(db.obj.users), self.standInOptions['dbUsers'])
+        return
+
+    def testFailingFuture(self):
+        asyncAccount = self.asyncAccount
+        future = asyncAccount.login(self.standIn.username, 'wrong')
+        self.assertIsInstance(future.exception(10), CloudSitesAutomate.CloudSitesError)
+        self.assertRaises(CloudSitesAutomate.CloudSitesError, future.result, 10)
+
+        asyncAccount.login(self.standIn.username, self.standIn.password).result(10)
+        clientIDs = asyncAccount.getClientList().result(10)
+        client = asyncAccount.getClient(clientIDs[0])
+        websiteIDs = client.getWebsiteList().result(10)
+        website = client.getWebsite(websiteIDs[0])
+        db = website.getDatabase(website.getFeatures().result(10)[0][0])
+        # gather fails with the exception of the failing future
+        combined = CloudSitesAutomate.gather([client.getUserList(), db.changePassword('nosuch', 'newpassword1')])
+        self.assertIn('nosuch', str(combined.exception(10)))
+        return
+
+    def testClose(self):
+        asyncAccount = self.asyncAccount
+        future = asyncAccount.login(self.standIn.username, self.standIn.password)
+        threads = list(asyncAccount._executor._threads)
+        asyncAccount.close()
+        # Calls made before close() still run, then the workers exit
+        self.assertTrue(future.result(10))
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertRaises(CloudSitesAutomate.CloudSitesError, asyncAccount.getClientList)
+        return
+
+
+class LookupTest(StandInTestCase):
+
+    def checkLookups(self, account):
+        websites = [website for client in account.clientList.values() for website in client.websites.values()]
+        for client in account.clientList.values():
+            for userName in client.users:
+                self.assertIs(account.findFtpUser(userName), client)
+            for website in client.websites.values():
+                self.assertIs(account.findWebsite(website.domainName), website)
+                self.assertIs(account.findWebsite(website.domainName.upper()), website)
+        self.assertEqual(account.findWebsites('example.com'),
+                         sorted(websites, key=lambda website: website.domainName))
+        for db in self.databases(account):
+            for userName in db.users:
+                self.assertIs(account.findDatabaseUser(userName), db)
+        return
+
+    def testReloads(self):
+        account = self.login()
+        account.crawl(2)
+        self.checkLookups(account)
+        client = account.clientList.values()[0]
+        website = client.websites.values()[0]
+        db = website.databaseList.values()[0]
+        userName = sorted(db.users)[0]
+
+        # Reloaded children replace the old ones in the indexes (once their detail is loaded)
+        website.getFeatures()
+        self.assertIs(account.findDatabaseUser(userName), None)
+        website.databaseList[db.name].getDetail()
+        self.checkLookups(account)
+        client.getWebsiteList()
+        self.assertIs(account.findDatabaseUser(userName), None)
+        self.assertIs(account.findWebsite(website.domainName), client.websites[website.websiteID])
+
+        account.crawl(2)
+        self.checkLookups(account)
+        # One entry per client (domains, FTP users) and database (users), none for replaced objects
+        self.assertEqual(len(account._indexedKeys), 2 * len(account.clientList) + len(self.databases(account)))
+        account.getClientList()
+        self.assertEqual(account._indexedKeys, { })
+        self.assertIs(account.findWebsite(website.domainName), None)
+        return
+
+
+class BulkJobsTest(StandInTestCase):
+
+    def testJournal(self):
+        account = self.login()
+        account.crawl(2)
+        databases = self.databases(account)
+        jobs = [(db, userName, 'newpassword1') for db in databases for userName in sorted(db.users)]
+        jobs += [(db, 'bulk', 'newpassword2', 'createUser') for db in databases]
+        jobs.append((databases[0], 'nosuch', 'newpassword3'))
+        journal = os.path.join(self.directory, 'journal.jsonl')
+
+        results = account.bulkDatabaseUsers(jobs[:3], 2, journal)
+        self.assertEqual([result['status'] for result in results], ['done'] * 3)
+
+        results = account.bulkDatabaseUsers(jobs, 2, journal)
+        statuses = [result['status'] for result in results]
+        self.assertEqual(statuses[:3], ['skipped'] * 3)
+        self.assertEqual(statuses[3:-1], ['done'] * (len(jobs) - 4))
+        self.assertEqual(statuses[-1], 'failed')
+        self.assertIn('nosuch', results[-1]['error'])
+        for db in databases:
+            self.assertEqual(self.standIn.extraUsers[db.name]['bulk'], 'newpassword2')
+        with open(journal) as f:
+            self.assertEqual(len(f.readlines()), len(jobs))
+        return
+
+    def testCreateUserReusePage(self):
+        account = self.login()
+        account.crawl(2)
+        db = self.databases(account)[0]
+        # The browser is not on the database's page: it is loaded before filling in the form
+        account.browser.open(account.baseURL + '/Home.do')
+        self.assertTrue(db.createUser('reuse', 'newpassword4', reusePage=True))
+        self.assertEqual(self.standIn.extraUsers[db.name]['reuse'], 'newpassword4')
+        return
+
+    def testPlan(self):
+        account = self.login()
+        stats = CloudSitesAutomate.Stats()
+        account.addHook(stats)
+        account.crawl(2)
+        databases = self.databases(account)
+        jobs = [(db.name, 'bulk', 'newpassword2', 'createUser') for db in databases]
+        jobs.append(('nosuch_db', 'bulk', 'newpassword2', 'createUser'))
+        plan = account.planDatabaseUsers(jobs, 2)
+        self.assertEqual(plan.requests, 2 * len(databases))
+        self.assertEqual(len(plan.unresolved), 1)
+        stats.reset()
+        results = plan.run()
+        self.assertEqual([result['status'] for result in results], ['done'] * len(databases) + ['failed'])
+        # Every request the plan counted (form submits included) shows up in Stats
+        requests = stats.summary()['request']
+        self.assertEqual(sum(entry['count'] for entry in requests.values()), plan.requests)
+        self.assertRaises(CloudSitesAutomate.CloudSitesError, account.planDatabaseUsers,
+                          [(databases[0], 'bulk', 'newpassword2', 'dropUser')])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()